@@ -1,42 +1,717 @@
-from flask import Flask, request, jsonify, abort
+import hashlib
+import io
+import json
+import os
+from collections import namedtuple
+from datetime import timezone
+from functools import wraps
+
+import click
+from flask import (Flask, Response, current_app, g, request, jsonify, abort,
+                   stream_with_context)
 from flask_cors import CORS
+from sqlalchemy import func, select
+
+from auth.auth import AuthError, requires_auth, token_cache
+from database.cache import CachedResponse, response_cache
+from database.models import (BULK_CHUNK_SIZE, Actor, BulkInsertError, Cast,
+                             Movie, ScheduleConflict, VersionConflict, db,
+                             setup_db)
+from database.filters import InvalidFilter, actor_filters, movie_filters
+from database.pagination import (InvalidPageRequest, keyset_page,
+                                 next_cursor, page_limit)
+from database.routing import replica_lagging
+from database.schedule import available
+from database.search import MAX_SEARCH_LIMIT, SEARCH_LIMIT, search
+from database.serializers import (JSONProvider, actor_schema, dumps,
+                                  movie_schema)
+from database.stats import actor_stats, movie_stats, rebuild_rollups
+from database.validation import (PreconditionRequired, ValidationError,
+                                 parse_actor, parse_date, parse_movie,
+                                 parse_precondition)
+from instrumentation import metrics, profiling
+from instrumentation.metrics import METRICS, count_auth
+from instrumentation.profiling import PROFILE
+from middleware import compression, idempotency, ratelimit
+from middleware.compression import COMPRESSION, mark_encoded, precompressed
+from middleware.idempotency import IdempotencyError, idempotent
+from middleware.ratelimit import Throttled
+
+MOVIE_SORTS = ('id', 'title', 'release_date')
+ACTOR_SORTS = ('id', 'name', 'age')
+NDJSON = 'application/x-ndjson'
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 1000))
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 100000))
+BULK_MAX_CHUNK_SIZE = 10000
+MAX_REPORTED_ERRORS = 100
+
+
+# Request helpers. They take the request, so that asgi.py serves the same
+# parameters over the Quart request (which has the same API).
+
+def included(request, relationships):
+    '''
+    Reads the comma separated ?include= parameter, naming related records to
+    embed in the response. Aborts with 400 unless every name is one of
+    relationships.
+    '''
+    include = {name.strip() for name
+               in request.args.get('include', '').split(',') if name.strip()}
+    if not include <= set(relationships):
+        abort(400)
+    return include
+
+
+def fieldset(request, schema):
+    '''
+    Reads the comma separated ?fields= parameter, naming the fields of
+    schema to return: schema narrowed to them, or schema itself without the
+    parameter. Aborts with 400 on a name that is not a field of schema.
+    '''
+    fields = [name.strip() for name
+              in request.args.get('fields', '').split(',') if name.strip()]
+    if not fields:
+        return schema
+    try:
+        return schema.only(fields)
+    except ValueError:
+        abort(400)
+
+
+def dump_rows(schema, rows, include=()):
+    '''
+    Dumps rows (instances or column-only Rows) of schema with the included
+    relationships, loaded with one extra SELECT ... WHERE id IN (...) each,
+    however many rows there are.
+    '''
+    ids = [row.id for row in rows]
+    related = {name: db.session.execute(schema.related_query(name, ids)).all()
+               for name in include} if ids else None
+    return schema.dump_all(rows, related)
+
+
+def wants_stream(request):
+    '''
+    True when the client asked for the whole table as NDJSON, either with
+    ?stream=1 or by preferring application/x-ndjson in its Accept header.
+    '''
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(
+        ['application/json', NDJSON]) == NDJSON
+
+
+def stream_rows(statement, schema, include=()):
+    '''
+    Streams every row of statement as one JSON document per line. Rows are
+    read through a server-side cursor in STREAM_BATCH_SIZE batches, so memory
+    use does not depend on the size of the table.
+    '''
+    def generate():
+        result = db.session.execute(
+            statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+        for rows in result.partitions():
+            yield b''.join(dumps(row) + b'\n'
+                           for row in dump_rows(schema, rows, include))
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON)
+
+
+def page_request(request, sorts):
+    '''
+    Reads the limit, after and sort query parameters of a list request.
+    sort is one of sorts, optionally prefixed with - for descending order.
+    Aborts with 400 if any of them is invalid.
+    '''
+    sort = request.args.get('sort', 'id')
+    if sort.lstrip('-') not in sorts:
+        abort(400)
+    try:
+        limit = page_limit(request.args.get('limit'))
+    except InvalidPageRequest:
+        abort(400)
+    return sort, request.args.get('after'), limit
+
+
+def list_filters(request, filters):
+    '''
+    Compiles the filter query parameters of a list request with filters
+    (movie_filters or actor_filters). Aborts with 400 on a malformed value.
+    '''
+    try:
+        return filters(request.args)
+    except InvalidFilter:
+        abort(400)
+
+
+def availability_window(request):
+    '''
+    Reads the from and to dates of an /actors/available request. Aborts with
+    400 unless both are valid and from is not after to.
+    '''
+    try:
+        starts = parse_date(request.args, 'from')
+        ends = parse_date(request.args, 'to')
+    except (KeyError, ValidationError):
+        abort(400)
+    if starts > ends:
+        abort(400)
+    return starts, ends
+
+
+'''
+ListQuery
+    What a list request asks for: statement selects its rows, one page
+    (sort, limit) or, for a stream, every row in id order; they are dumped
+    with schema and the include relationships.
+'''
+ListQuery = namedtuple('ListQuery',
+                       'stream statement schema include sort limit')
+
+
+def list_query(request, model, schema, filters, sorts, relationships=(),
+               where=(), streams=True):
+    '''
+    Reads the filter, include, fields, stream (unless streams is False) and
+    page parameters of a list request of model into a ListQuery. where adds
+    conditions of the route's own. Aborts with 400 on an invalid parameter.
+    '''
+    conditions = (*where, *list_filters(request, filters))
+    include = included(request, relationships) if relationships else ()
+    schema = fieldset(request, schema)
+    if streams and wants_stream(request):
+        return ListQuery(True, select(*schema.columns_with('id'))
+                         .where(*conditions).order_by(model.id),
+                         schema, include, None, None)
+
+    sort, after, limit = page_request(request, sorts)
+    try:
+        statement = keyset_page(
+            select(*schema.columns_with('id', sort.lstrip('-')))
+            .where(*conditions),
+            model, sort, after, limit)
+    except InvalidPageRequest:
+        abort(400)
+    return ListQuery(False, statement, schema, include, sort, limit)
+
+
+def schedule_conflict(e):
+    return {
+        'success': False,
+        'error': 409,
+        'message': 'schedule conflict',
+        'conflicts': [{'actor': actor_id, 'movie': movie_id}
+                      for actor_id, movie_id in e.conflicts]
+    }, 409
+
+
+def version_conflict(e):
+    return {
+        'success': False,
+        'error': 412,
+        'message': 'precondition failed',
+        'version': e.version
+    }, 412
+
+
+def bulk_items():
+    '''
+    Yields the items of a bulk request body: the elements of a JSON array,
+    or the lines of an NDJSON body read from the request stream.
+    '''
+    if request.mimetype == NDJSON:
+        # already read whole when it was fingerprinted (see idempotent)
+        lines = (io.BytesIO(g.request_body) if 'request_body' in g
+                 else request.stream)
+        for line in lines:
+            if line.strip():
+                yield line
+        return
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, list):
+        abort(400)
+    yield from body
+
+
+def bulk_create(model, parse):
+    '''
+    Validates every item of a bulk request before writing any of them, then
+    inserts them in batched multi-row INSERTs. Responds 422 with the index
+    and reason of each invalid item (up to MAX_REPORTED_ERRORS).
+    ?chunk_size= sets the rows per INSERT and ?commit=chunk commits each
+    chunk separately instead of using one transaction.
+    '''
+    rows = []
+    errors = []
+    for index, item in enumerate(bulk_items()):
+        if index >= BULK_MAX_ITEMS:
+            errors.append({'index': index,
+                           'message': f'at most {BULK_MAX_ITEMS} items'})
+            break
+        try:
+            if isinstance(item, bytes):
+                try:
+                    item = json.loads(item)
+                except ValueError:
+                    raise ValidationError('invalid JSON')
+            rows.append(parse(item))
+        except ValidationError as e:
+            errors.append({'index': index, 'message': str(e)})
+
+    if not rows and not errors:
+        errors.append({'index': 0, 'message': 'no items'})
+    if errors:
+        return jsonify({
+            'success': False,
+            'error': 422,
+            'message': 'unprocessable',
+            'errors': errors[:MAX_REPORTED_ERRORS]
+        }), 422
 
-from auth.auth import AuthError, requires_auth
-from database.models import Actor, Movie, setup_db
+    chunk_size = request.args.get('chunk_size', BULK_CHUNK_SIZE, type=int)
+    chunk_size = max(1, min(chunk_size, BULK_MAX_CHUNK_SIZE))
+    try:
+        ids = model.insert_many(
+            rows, chunk_size=chunk_size,
+            commit_chunks=request.args.get('commit') == 'chunk')
+    except BulkInsertError as e:
+        current_app.logger.exception('bulk insert of %s failed',
+                                     model.__tablename__)
+        return jsonify({
+            'success': False,
+            'error': 422,
+            'message': 'unprocessable',
+            'ids': e.ids
+        }), 422
+
+    return jsonify({
+        'success': True,
+        'created': len(ids),
+        'ids': ids
+    }), 200
+
+
+def make_etag(request, *version):
+    '''
+    Strong ETag for the representation of a resource at the given version,
+    as requested by the URL of request.
+    '''
+    key = repr((request.path, request.query_string) + version)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def add_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return response
+
+
+def not_modified(request, etag, last_modified, response_class=Response):
+    '''
+    Returns a bodiless 304 response if the client's copy, identified by
+    If-None-Match or else If-Modified-Since, is still current, otherwise None.
+    If-None-Match compares weakly, matching the ETags of compressed bodies.
+    '''
+    if request.if_none_match:
+        current = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified is not None:
+        current = (last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+                   <= request.if_modified_since)
+    else:
+        current = False
+    if not current:
+        return None
+    return add_validators(response_class(status=304), etag, last_modified)
+
+
+def collection_query(model):
+    # the row count catches deletes, max(updated_at) the rest
+    return select(func.count(model.id), func.max(model.updated_at))
+
+
+def collection_validators(model):
+    '''
+    ETag and Last-Modified of a list request, from one aggregate query over
+    the table (collection_query).
+    '''
+    count, last_modified = db.session.execute(collection_query(model)).one()
+    return make_etag(request, count, last_modified), last_modified
+
+
+def version_query(model, id):
+    return select(model.updated_at, model.version).where(model.id == id)
+
+
+def row_validators(request, version):
+    '''
+    ETag and Last-Modified of a single movie or actor, from its
+    version_query row. The ETag is the row version, which If-Match is
+    checked against on PATCH, then the hash of make_etag (updated_at
+    changes with the cast too).
+    '''
+    last_modified = version.updated_at
+    return (f'{version.version}-{make_etag(request, last_modified)}',
+            last_modified)
+
+
+def cache_key(request, kind, kwargs):
+    # the resource id (if any) and the request URL
+    return response_cache.key(kind, kwargs.get('id'), request.full_path)
+
+
+def cache_mode(kind, read_replica):
+    '''
+    Whether a GET of kind may read the response cache and store in it, given
+    where its reads go: read_replica is None without a replica, False when
+    the client wrote recently and reads the primary. Those reads skip the
+    cache, which may hold what the replica served before their write. Reads
+    on the replica are not stored while it may lag behind a write of kind,
+    so that other clients are not served them for CACHE_TTL.
+    '''
+    if read_replica is None:
+        return True, True
+    if not read_replica:
+        return False, False
+    return True, not replica_lagging(kind)
+
+
+def serve_cached(request, entry, key, response_class=Response):
+    '''
+    The response for the cached entry stored under key: a 304 when the
+    client's copy is current, otherwise its body, compressed if the client
+    accepts it (see precompressed).
+    '''
+    last_modified = (entry.last_modified.replace(tzinfo=None)
+                     if entry.last_modified else None)
+    cached = not_modified(request, entry.etag, last_modified, response_class)
+    if cached:
+        return cached
+    body, coding = precompressed(entry, key, request.accept_encodings)
+    response = add_validators(
+        response_class(body, mimetype='application/json'), entry.etag,
+        last_modified)
+    if coding is not None:
+        mark_encoded(response, coding)
+    return response
+
+
+def cached_response(kind):
+    '''
+    Serves a GET handler from the response cache, keyed by the resource id
+    (if any) and the request URL. Only 200 responses are cached, with their
+    validators, so conditional requests are answered from the cache too.
+    Compressed bodies are cached beside them (see precompressed). Streamed
+    responses bypass the cache, as do reads routed around it (cache_mode).
+    '''
+    def cached_response_decorator(f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            read, store = cache_mode(kind, g.get('read_replica'))
+            if not read or wants_stream(request):
+                return f(payload, *args, **kwargs)
+
+            def compute():
+                response = current_app.make_response(
+                    f(payload, *args, **kwargs))
+                etag, _ = response.get_etag()
+                if response.status_code != 200 or etag is None:
+                    return response
+                return CachedResponse(response.get_data(), etag,
+                                      response.last_modified)
+
+            key = cache_key(request, kind, kwargs)
+            entry = response_cache.get_or_set(key, compute, store)
+            if not isinstance(entry, CachedResponse):
+                return entry
+            return serve_cached(request, entry, key)
+
+        return wrapper
+    return cached_response_decorator
+
+
+# Write handlers. They return the response (body, status) of a request from
+# its parsed parts, so that asgi.py runs the same ones through run_write.
+
+def create_movie(body):
+    try:
+        values = parse_movie(body)
+    except ValidationError as e:
+        return {'success': False, 'error': str(e)}, 422
+
+    try:
+        new_movie = Movie(title=values.pop('title'),
+                          release_date=values.pop('release_date'))
+        for field, value in values.items():
+            setattr(new_movie, field, value)
+
+        Movie.insert(new_movie)
+
+        return {
+            'success': True,
+            'movies': new_movie.title
+        }, 200
+
+    except:
+        abort(400)
+
+
+def update_movie(id, body, if_match):
+    try:
+        versions, data = parse_precondition(if_match, body)
+        values = parse_movie(data, partial=True)
+    except PreconditionRequired:
+        abort(428)
+    except ValidationError as e:
+        return {'success': False, 'error': str(e)}, 422
+
+    try:
+        movie = Movie.update_by_id(id, values, versions)
+    except ScheduleConflict as e:
+        return schedule_conflict(e)
+    except VersionConflict as e:
+        return version_conflict(e)
+    except ValidationError as e:
+        return {'success': False, 'error': str(e)}, 422
+    except Exception:
+        current_app.logger.exception('updating movie %s failed', id)
+        abort(422)
+
+    if movie is None:
+        return {'success': False, 'error': 'Movie Not Found'}, 404
+
+    return {
+        'success': True,
+        'movie': movie.title,
+        'version': movie.version
+    }, 200
+
+
+def delete_movie(id):
+    try:
+        deleted = Movie.delete_by_id(id)
+    except Exception:
+        current_app.logger.exception('deleting movie %s failed', id)
+        abort(422)
+
+    if not deleted:
+        abort(404)
+
+    return {
+        'success': True,
+        'deleted_movie': id
+    }, 200
+
+
+def create_actor(body):
+    try:
+        values = parse_actor(body)
+    except ValidationError as e:
+        return {'success': False, 'error': str(e)}, 422
+
+    try:
+        new_actor = Actor(name=values['name'],
+                          age=values['age'],
+                          gender=values['gender'])
+
+        Actor.insert(new_actor)
+
+        return {
+            'success': True,
+            'name': new_actor.name,
+            'age': new_actor.age,
+            'gender': new_actor.gender
+        }, 200
+
+    except:
+        abort(400)
+
+
+def update_actor(id, body, if_match):
+    try:
+        versions, data = parse_precondition(if_match, body)
+        values = parse_actor(data, partial=True)
+    except PreconditionRequired:
+        abort(428)
+    except ValidationError as e:
+        return {'success': False, 'error': str(e)}, 422
+
+    try:
+        actor = Actor.update_by_id(id, values, versions)
+    except VersionConflict as e:
+        return version_conflict(e)
+    except Exception:
+        current_app.logger.exception('updating actor %s failed', id)
+        abort(422)
+
+    if actor is None:
+        abort(404)
+
+    return {
+        'success': True,
+        'actor': actor_schema.dump(actor)
+    }, 200
+
+
+def delete_actor(id):
+    try:
+        deleted = Actor.delete_by_id(id)
+    except Exception:
+        current_app.logger.exception('deleting actor %s failed', id)
+        abort(422)
+
+    if not deleted:
+        abort(404)
+
+    return {
+        'success': True,
+        'deleted_actor': id
+    }, 200
+
+
+def register_error_handlers(app):
+    '''
+    Registers the JSON error responses on app: the Flask app or the Quart one
+    of asgi.py, which converts the same return values.
+    '''
+
+    @app.errorhandler(400)
+    def bad_request(error):
+        return {
+            "success": False,
+            "error": 400,
+            "message": "bad request"
+        }, 400
+
+    @app.errorhandler(422)
+    def unprocessable(error):
+        return {
+            "success": False,
+            "error": 422,
+            "message": "unprocessable"
+        }, 422
+
+    @app.errorhandler(404)
+    def not_found(error):
+        return {
+            "success": False,
+            "error": 404,
+            "message": "resource not found"
+        }, 404
+
+    @app.errorhandler(403)
+    def forbidden(error):
+        return {
+            "success": False,
+            "error": 403,
+            "message": "forbidden"
+        }, 403
+
+    @app.errorhandler(428)
+    def precondition_required(error):
+        return {
+            "success": False,
+            "error": 428,
+            "message": "If-Match or version required"
+        }, 428
+
+    @app.errorhandler(AuthError)
+    def auth_error(auth_error):
+        count_auth(auth_error.error['code'])
+        return {
+            "success": False,
+            "error": auth_error.status_code,
+            "message": auth_error.error
+        }, auth_error.status_code
+
+    @app.errorhandler(Throttled)
+    def throttled(error):
+        return {
+            "success": False,
+            "error": error.status_code,
+            "message": error.message
+        }, error.status_code, {'Retry-After': str(error.retry_after)}
+
+    @app.errorhandler(IdempotencyError)
+    def idempotency_error(error):
+        headers = {}
+        if error.retry_after is not None:
+            headers['Retry-After'] = str(error.retry_after)
+        return {
+            "success": False,
+            "error": error.status_code,
+            "message": error.message
+        }, error.status_code, headers
+
+    @app.errorhandler(401)
+    def unauthorized(error):
+        return {
+            "success": False,
+            "error": 401,
+            "message": 'Unathorized'
+        }, 401
+
+    @app.errorhandler(500)
+    def serverError(error):
+        return {
+            "success": False,
+            "error": 500,
+            "message": "Internal Server Error"
+        }, 500
 
 
 def create_app(active=True, test_config=None):
     app = Flask(__name__)
+    app.json = JSONProvider(app)
+    if PROFILE:
+        # first, so that the timings cover the other request hooks
+        profiling.init_app(app)
     with app.app_context():
         if active:
             setup_db(app)
     CORS(app)
+    if METRICS:
+        metrics.init_app(app, lambda: db.engines,
+                         {'response': response_cache, 'token': token_cache})
+    if COMPRESSION:
+        compression.init_app(app)
+    # after metrics, so that the requests turned away are counted
+    ratelimit.init_app(app)
 
 
 # ROUTES
 # --------------------Movies----------------
 
-# Get all the movies
+# Get the movies, one page at a time
 
     @app.route('/movies')
     @requires_auth('get:movies')
+    @cached_response('movies')
     def getAllMovies(payload):
+        etag, last_modified = collection_validators(Movie)
+        cached = not_modified(request, etag, last_modified)
+        if cached:
+            return cached
+
+        query = list_query(request, Movie, movie_schema, movie_filters,
+                           MOVIE_SORTS, ('actors',))
+        if query.stream:
+            return add_validators(stream_rows(
+                query.statement, query.schema, query.include),
+                etag, last_modified)
+
         try:
-            movies = Movie.query.all()
-
-            serialized_movies = []
-            for movie in movies:
-                serialized_movie = {
-                    'id': movie.id,
-                    'title': movie.title,
-                    'release_date': movie.release_date.strftime('%Y-%m-%d') if movie.release_date else None
-                }
-                serialized_movies.append(serialized_movie)
-
-            return jsonify({
+            movies, next_page = next_cursor(
+                db.session.execute(query.statement).all(), query.sort,
+                query.limit)
+
+            response = jsonify({
                 'success': True,
-                'movies': serialized_movies
-            }), 200
+                'movies': dump_rows(query.schema, movies, query.include),
+                'next': next_page
+            })
+            return add_validators(response, etag, last_modified), 200
 
         except:
             abort(401)
@@ -45,24 +720,30 @@ def create_app(active=True, test_config=None):
 
     @app.route('/movies/<int:id>')
     @requires_auth('get:movies')
+    @cached_response('movies')
     def getByMovieId(payload, id):
+        include = included(request, ('actors',))
+        schema = fieldset(request, movie_schema)
         try:
-            movie = Movie.query.get(id)
+            version = db.session.execute(
+                version_query(Movie, id)).one_or_none()
 
-            if not movie:
+            if not version:
                 return jsonify(
                     {'success': False, 'error': 'Movie Not Found'}), 404
 
-            serialized_movie = {
-                'id': movie.id,
-                'title': movie.title,
-                'release_date': movie.release_date.strftime('%Y-%m-%d') if movie.release_date else None
-            }
+            etag, last_modified = row_validators(request, version)
+            cached = not_modified(request, etag, last_modified)
+            if cached:
+                return cached
 
-            return jsonify({
+            movie = db.session.execute(select(*schema.columns_with('id'))
+                                       .where(Movie.id == id)).one()
+            response = jsonify({
                 'success': True,
-                'movies': serialized_movie
-            }), 200
+                'movies': dump_rows(schema, [movie], include)[0]
+            })
+            return add_validators(response, etag, last_modified), 200
         except:
             abort(401)
 
@@ -70,123 +751,165 @@ def create_app(active=True, test_config=None):
 
     @app.route('/movies', methods=['POST'])
     @requires_auth('post:movies')
+    @idempotent
     def createMovie(payload):
-        try:
-            body = request.json
-            new_movie = Movie(title=body['title'],
-                              release_date=body['release_date'])
-            
-            if new_movie.title == '' or new_movie.release_date == '':
-                return jsonify(
-                    {'success': False, 'error': 'Movie name cannot be null'}), 422
-                
-            Movie.insert(new_movie)
+        return create_movie(request.get_json(silent=True))
 
-            return jsonify({
-                'success': True,
-                'movies': new_movie.title
-            }), 200
+    # Create many Movies at once
 
-        except:
-            abort(400)
+    @app.route('/movies/bulk', methods=['POST'])
+    @requires_auth('post:movies')
+    @idempotent
+    def createMovies(payload):
+        return bulk_create(Movie, parse_movie)
 
     # Update the existing movie detail
 
     @app.route('/movies/<int:id>', methods=['PATCH'])
     @requires_auth('patch:movies')
     def updateMovie(payload, id):
-        try:
-            body = request.json
-            movie = Movie.query.get(id)
-
-            if not movie:
-                abort(404)
-
-            title = body['title']
-            release_date = body['release_date']
-            Movie.update(movie, title, release_date)
-
-            return jsonify({
-                'success': True,
-                'movie': movie.title
-            }), 200
-
-        except Exception as e:
-            print(e)
-            return jsonify(
-                {'success': False, 'error': 'Failed to update movie'}), 404
+        return update_movie(id, request.get_json(silent=True),
+                            request.if_match)
 
     # Delete the created movie
 
     @app.route('/movies/<int:id>', methods=['DELETE'])
     @requires_auth('delete:movies')
     def deleteMovie(payload, id):
+        return delete_movie(id)
 
-        movie = Movie.query.filter(Movie.id == id).one_or_none()
+    # Cast an actor in the movie
+
+    @app.route('/movies/<int:id>/actors/<int:actor_id>', methods=['PUT'])
+    @requires_auth('patch:movies')
+    def assignActor(payload, id, actor_id):
+        try:
+            assigned = Cast.assign(id, actor_id)
+        except ScheduleConflict as e:
+            return schedule_conflict(e)
+        except Exception:
+            current_app.logger.exception(
+                'casting actor %s in movie %s failed', actor_id, id)
+            abort(422)
 
-        if not movie:
+        if not assigned:
             abort(404)
 
-        try:
-            Movie.delete(movie)
-            return jsonify({
-                'success': True,
-                'deleted_movie': id
-            }), 200
+        return jsonify({
+            'success': True,
+            'movie': id,
+            'actor': actor_id
+        }), 200
 
-        except:
+    # Remove an actor from the movie's cast
+
+    @app.route('/movies/<int:id>/actors/<int:actor_id>', methods=['DELETE'])
+    @requires_auth('patch:movies')
+    def unassignActor(payload, id, actor_id):
+        try:
+            unassigned = Cast.unassign(id, actor_id)
+        except Exception:
+            current_app.logger.exception(
+                'removing actor %s from movie %s failed', actor_id, id)
             abort(422)
 
+        if not unassigned:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'movie': id,
+            'removed_actor': actor_id
+        }), 200
+
 # --------------------------ACTOR--------------------------
 
-    # Get all Actors details
+    # Get the Actors details, one page at a time
 
     @app.route('/actors')
     @requires_auth('get:actors')
+    @cached_response('actors')
     def getAllActors(payload):
+        etag, last_modified = collection_validators(Actor)
+        cached = not_modified(request, etag, last_modified)
+        if cached:
+            return cached
+
+        query = list_query(request, Actor, actor_schema, actor_filters,
+                           ACTOR_SORTS, ('movies',))
+        if query.stream:
+            return add_validators(stream_rows(
+                query.statement, query.schema, query.include),
+                etag, last_modified)
+
         try:
-            actors = Actor.query.all()
-
-            serialized_actors = []
-            for actor in actors:
-                serialized_actor = {
-                    'id': actor.id,
-                    'name': actor.name,
-                    'age': actor.age,
-                    'gender': actor.gender
-                }
-                serialized_actors.append(serialized_actor)
-
-            return jsonify({
+            actors, next_page = next_cursor(
+                db.session.execute(query.statement).all(), query.sort,
+                query.limit)
+
+            response = jsonify({
                 'success': True,
-                'actors': serialized_actors
-            }), 200
+                'actors': dump_rows(query.schema, actors, query.include),
+                'next': next_page
+            })
+            return add_validators(response, etag, last_modified), 200
         except:
             abort(401)
 
+    # Get the Actors free over a shooting window, one page at a time
+
+    @app.route('/actors/available')
+    @requires_auth('get:actors')
+    @cached_response('actors')
+    def getAvailableActors(payload):
+        starts, ends = availability_window(request)
+
+        etag, last_modified = collection_validators(Actor)
+        cached = not_modified(request, etag, last_modified)
+        if cached:
+            return cached
+
+        query = list_query(request, Actor, actor_schema, actor_filters,
+                           ACTOR_SORTS, where=(available(starts, ends),),
+                           streams=False)
+        actors, next_page = next_cursor(
+            db.session.execute(query.statement).all(), query.sort,
+            query.limit)
+        response = jsonify({
+            'success': True,
+            'actors': dump_rows(query.schema, actors),
+            'next': next_page
+        })
+        return add_validators(response, etag, last_modified), 200
+
     # Get Actor By ID
 
     @app.route('/actors/<int:id>')
     @requires_auth('get:actors')
+    @cached_response('actors')
     def getByActorId(payload, id):
+        include = included(request, ('movies',))
+        schema = fieldset(request, actor_schema)
         try:
-            actor = Actor.query.get(id)
+            version = db.session.execute(
+                version_query(Actor, id)).one_or_none()
 
-            if not actor:
+            if not version:
                 return jsonify(
                     {'success': False, 'error': 'Actor Not Found'}), 404
 
-            serialized_actor = {
-                'id': actor.id,
-                'name': actor.name,
-                'age': actor.age,
-                'gender': actor.gender
-            }
+            etag, last_modified = row_validators(request, version)
+            cached = not_modified(request, etag, last_modified)
+            if cached:
+                return cached
 
-            return jsonify({
+            actor = db.session.execute(select(*schema.columns_with('id'))
+                                       .where(Actor.id == id)).one()
+            response = jsonify({
                 'success': True,
-                'movies': serialized_actor
-            }), 200
+                'movies': dump_rows(schema, [actor], include)[0]
+            })
+            return add_validators(response, etag, last_modified), 200
         except:
             abort(401)
 
@@ -194,131 +917,101 @@ def create_app(active=True, test_config=None):
 
     @app.route('/actors', methods=['POST'])
     @requires_auth('post:actors')
+    @idempotent
     def createActor(payload):
-        try:
-            body = request.json
-            new_actor = Actor(name=body['name'],
-                              age=body['age'],
-                              gender=body['gender'])
-            
-            if new_actor.name == '' or new_actor.age is None or new_actor.gender == '':
-                return jsonify(
-                    {'success': False, 'error': 'Actor Details cannot be null'}), 422
-            
-            Actor.insert(new_actor)
+        return create_actor(request.get_json(silent=True))
 
-            return jsonify({
-                'success': True,
-                'name': new_actor.name,
-                'age': new_actor.age,
-                'gender': new_actor.gender
-            }), 200
+    # Create many Actors at once
 
-        except:
-            abort(400)
+    @app.route('/actors/bulk', methods=['POST'])
+    @requires_auth('post:actors')
+    @idempotent
+    def createActors(payload):
+        return bulk_create(Actor, parse_actor)
 
     # Update the existing Actor details
 
     @app.route('/actors/<int:id>', methods=['PATCH'])
     @requires_auth('patch:actors')
     def updateActor(payload, id):
-        try:
-            body = request.json
-            actor = Actor.query.get(id)
+        return update_actor(id, request.get_json(silent=True),
+                            request.if_match)
 
-            if not actor:
-                abort(404)
+    # Delete the created Actor details
 
-            name = body['name']
-            age = body['age']
-            gender = body['gender']
-            Actor.update(actor, name, age, gender)
+    @app.route('/actors/<int:id>', methods=['DELETE'])
+    @requires_auth('delete:actors')
+    def deleteActor(payload, id):
+        return delete_actor(id)
 
-            serialized_actor = {
-                'id': actor.id,
-                'name': actor.name,
-                'age': actor.age,
-                'gender': actor.gender
-            }
+# --------------------------SEARCH--------------------------
 
-            return jsonify({
-                'success': True,
-                'actor': serialized_actor
-            }), 200
+    # Search movie titles and actor names, best matches first.
+    # Actors are only included for tokens with get:actors.
 
-        except:
-            abort(404)
+    @app.route('/search')
+    @requires_auth('get:movies')
+    def searchCatalog(payload):
+        query = request.args.get('q', '').strip()
+        if not query:
+            abort(400)
+        limit = request.args.get('limit', SEARCH_LIMIT, type=int)
+        limit = max(1, min(limit, MAX_SEARCH_LIMIT))
 
-    # Delete the created Actor details
+        result = {
+            'success': True,
+            'movies': [dict(movie_schema.dump(movie), score=score)
+                       for movie, score in search('movies', query, limit)]
+        }
+        if 'get:actors' in payload.get('permissions', []):
+            result['actors'] = [
+                dict(actor_schema.dump(actor), score=score)
+                for actor, score in search('actors', query, limit)]
+        return jsonify(result), 200
 
-    @app.route('/actors/<int:id>', methods=['DELETE'])
-    @requires_auth('delete:actors')
-    def deleteActor(payload, id):
+# --------------------------STATS--------------------------
 
-        actor = Actor.query.filter(Actor.id == id).one_or_none()
+    # Movies per release year
 
-        if not actor:
-            abort(404)
+    @app.route('/stats/movies')
+    @requires_auth('get:movies')
+    @cached_response('movies')
+    def getMovieStats(payload):
+        etag, last_modified = collection_validators(Movie)
+        cached = not_modified(request, etag, last_modified)
+        if cached:
+            return cached
 
-        try:
-            Actor.delete(actor)
-            return jsonify({
-                'success': True,
-                'deleted_actor': id
-            }), 200
+        response = jsonify(dict(movie_stats(), success=True))
+        return add_validators(response, etag, last_modified), 200
 
-        except:
-            abort(422)
+    # Actors per age bucket and per gender
 
-    # Error Handling
+    @app.route('/stats/actors')
+    @requires_auth('get:actors')
+    @cached_response('actors')
+    def getActorStats(payload):
+        etag, last_modified = collection_validators(Actor)
+        cached = not_modified(request, etag, last_modified)
+        if cached:
+            return cached
 
-    @app.errorhandler(422)
-    def unprocessable(error):
-        return jsonify({
-            "success": False,
-            "error": 422,
-            "message": "unprocessable"
-        }), 422
+        response = jsonify(dict(actor_stats(), success=True))
+        return add_validators(response, etag, last_modified), 200
 
-    @app.errorhandler(404)
-    def not_found(error):
-        return jsonify({
-            "success": False,
-            "error": 404,
-            "message": "resource not found"
-        }), 404
+    # Recompute the statistics rollups: flask rebuild-rollups
 
-    @app.errorhandler(403)
-    def forbidden(error):
-        return jsonify({
-            "success": False,
-            "error": 403,
-            "message": "forbidden"
-        }), 403
+    @app.cli.command('rebuild-rollups')
+    def rebuildRollups():
+        rebuild_rollups()
 
-    @app.errorhandler(AuthError)
-    def auth_error(auth_error):
-        return jsonify({
-            "success": False,
-            "error": auth_error.status_code,
-            "message": auth_error.error
-        }), auth_error.status_code
+    # Delete the expired idempotency keys: flask purge-idempotency-keys
 
-    @app.errorhandler(401)
-    def unauthorized(error):
-        return jsonify({
-            "success": False,
-            "error": 401,
-            "message": 'Unathorized'
-        }), 401
+    @app.cli.command('purge-idempotency-keys')
+    def purgeIdempotencyKeys():
+        click.echo(f'{idempotency.purge()} keys deleted')
 
-    @app.errorhandler(500)
-    def serverError(error):
-        return jsonify({
-            "success": False,
-            "error": 500,
-            "message": "Internal Server Error"
-        }), 500
+    register_error_handlers(app)
 
     return app
 
@@ -0,0 +1,500 @@
+'''
+Async serving mode
+
+    hypercorn asgi:app        (or: uvicorn asgi:app)
+
+instead of gunicorn app:app. The movie and actor endpoints run as async
+handlers on one event loop per process: reads go through an asyncpg (or
+aiosqlite) AsyncSession and JWT verification is awaited in a worker thread,
+so thousands of requests can be in flight without a thread or connection
+each. Writes run the same model methods as the Flask app in a worker thread,
+so cache invalidation, the search and schedule indexes and the statistics
+rollups stay in one place. Every other request (bulk, cast, search, stats,
+CORS preflights) is passed on to the Flask app.
+'''
+import asyncio
+import os
+import time
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from quart import (Quart, Response, abort, g, jsonify, make_response,
+                   request)
+from quart.json.provider import \
+    DefaultJSONProvider as QuartDefaultJSONProvider
+from quart.wrappers.response import DataBody, IterableBody
+from sqlalchemy import select
+
+from app import (ACTOR_SORTS, MOVIE_SORTS, NDJSON, STREAM_BATCH_SIZE,
+                 add_validators, cache_key, cache_mode, collection_query,
+                 create_actor, create_movie, delete_actor, delete_movie,
+                 fieldset, included, list_query, make_etag, not_modified,
+                 register_error_handlers, row_validators, serve_cached,
+                 update_actor, update_movie, version_query, wants_stream)
+from app import app as flask_app
+from auth.auth import requires_auth_async
+from database.async_session import make_async_session
+from database.cache import CachedResponse, response_cache
+from database.filters import actor_filters, movie_filters
+from database import routing
+from database.models import Actor, Movie, replica_path, write_listeners
+from database.pagination import next_cursor
+from database.routing import (READ_METHODS, client_key, record_write,
+                              wrote_recently)
+from database.serializers import (JSONProvider, actor_schema, dumps,
+                                  movie_schema)
+from instrumentation.metrics import METRICS, observe_request
+from middleware.compression import (COMPRESS_MIN_SIZE, COMPRESSION, compress,
+                                    compress_stream_async, mark_encoded,
+                                    wants_compression)
+from middleware.idempotency import (HEADER, abandon, claim, finish,
+                                    fingerprint, replay)
+from middleware.idempotency import client_key as idempotency_key
+from middleware.ratelimit import (BUSY_RETRY_AFTER, MAX_IN_FLIGHT,
+                                  UNLIMITED_PATHS, Throttled)
+
+# Threads serving the requests passed on to the Flask app.
+WSGI_WORKERS = int(os.environ.get('WSGI_WORKERS', 10))
+
+
+# Request helpers: those of app.py that touch the session or await
+
+async def collection_validators(session, model):
+    count, last_modified = (await session.execute(
+        collection_query(model))).one()
+    return make_etag(request, count, last_modified), last_modified
+
+
+def cached_response(kind):
+    '''The cached_response decorator of app.py for async handlers.'''
+    def cached_response_decorator(f):
+        @wraps(f)
+        async def wrapper(payload, *args, **kwargs):
+            read, store = cache_mode(kind, g.get('read_replica'))
+            if not read or wants_stream(request):
+                return await f(payload, *args, **kwargs)
+
+            async def compute():
+                response = await make_response(
+                    await f(payload, *args, **kwargs))
+                etag, _ = response.get_etag()
+                if response.status_code != 200 or etag is None:
+                    return response
+                return CachedResponse(await response.get_data(), etag,
+                                      response.last_modified)
+
+            key = cache_key(request, kind, kwargs)
+            entry = await response_cache.get_or_set_async(key, compute,
+                                                          store)
+            if not isinstance(entry, CachedResponse):
+                return entry
+            return serve_cached(request, entry, key, Response)
+
+        return wrapper
+    return cached_response_decorator
+
+
+async def dump_rows(session, schema, rows, include=()):
+    '''
+    As in app.py, through an AsyncSession.
+    '''
+    ids = [row.id for row in rows]
+    related = {name: (await session.execute(
+        schema.related_query(name, ids))).all()
+        for name in include} if ids else None
+    return schema.dump_all(rows, related)
+
+
+class QuartJSONProvider(QuartDefaultJSONProvider):
+    # app.py's JSONProvider, for Quart
+    dumps = JSONProvider.dumps
+    response = JSONProvider.response
+
+
+async def run_write(f, *args):
+    '''
+    Runs a model write in a worker thread, inside a Flask app context so
+    that it uses the Flask app's session, listeners and all.
+    '''
+    def write():
+        with flask_app.app_context():
+            return f(*args)
+
+    return await asyncio.to_thread(write)
+
+
+def idempotent(f):
+    '''
+    middleware.idempotency.idempotent for async handlers: the key is
+    claimed and settled through run_write.
+    '''
+    @wraps(f)
+    async def wrapper(payload, *args, **kwargs):
+        if HEADER not in request.headers:
+            return await f(payload, *args, **kwargs)
+        client, key = idempotency_key(payload, request.headers[HEADER])
+        stored = await run_write(claim, client, key, fingerprint(
+            request.method, request.full_path, await request.get_data()))
+        if stored is not None:
+            return replay(stored, Response)
+
+        try:
+            response = await make_response(
+                await f(payload, *args, **kwargs))
+        except BaseException:
+            await run_write(abandon, client, key)
+            raise
+        await run_write(finish, client, key, response.status_code,
+                        await response.get_data())
+        return response
+
+    return wrapper
+
+
+def create_asgi_app(session_factory=None, replica_factory=None):
+    app = Quart(__name__)
+    app.json = QuartJSONProvider(app)
+    Session = session_factory or make_async_session()
+    if replica_factory is None and replica_path:
+        replica_factory = make_async_session(replica_path)
+
+    if replica_factory is not None:
+        # as database.routing.init_app does for the Flask app
+        if routing.on_write not in write_listeners:
+            write_listeners.append(routing.on_write)
+
+        @app.before_request
+        async def route_reads():
+            # the replica, unless the client wrote within READ_YOUR_WRITES
+            g.read_replica = (request.method in READ_METHODS and
+                              not wrote_recently(client_key(request.headers)))
+
+    def ReadSession():
+        if g.get('read_replica'):
+            return replica_factory()
+        return Session()
+
+    def stream_rows(statement, schema, include=()):
+        # opened here, as the body is generated outside the request context
+        read_session = ReadSession()
+
+        async def generate():
+            async with read_session as session:
+                result = await session.stream(
+                    statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+                async for rows in result.partitions():
+                    rows = await dump_rows(session, schema, rows, include)
+                    yield b''.join(dumps(row) + b'\n' for row in rows)
+
+        return Response(generate(), mimetype=NDJSON)
+
+    @app.after_request
+    async def cors(response):
+        # what flask-cors' defaults send
+        if 'Origin' in request.headers:
+            response.headers['Access-Control-Allow-Origin'] = \
+                request.headers['Origin']
+            response.vary.add('Origin')
+        else:
+            response.headers['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    if METRICS:
+        # /metrics itself is served by the Flask app
+        @app.before_request
+        async def start_timer():
+            g.metrics_started = time.perf_counter()
+
+        @app.after_request
+        async def record_request(response):
+            if 'metrics_started' in g:
+                observe_request(request.method, request.url_rule,
+                                response.status_code, g.metrics_started)
+            return response
+
+    @app.after_request
+    async def remember_writes(response):
+        if replica_factory is not None and \
+                request.method not in READ_METHODS and \
+                response.status_code < 400:
+            record_write(client_key(request.headers))
+        return response
+
+    if COMPRESSION:
+        @app.after_request
+        async def compress_response(response):
+            # middleware.compression.compress_response, for Quart bodies
+            coding = wants_compression(response, request.accept_encodings)
+            if coding is None:
+                return response
+            if isinstance(response.response, IterableBody):
+                response.response = IterableBody(compress_stream_async(
+                    aiter(response.response), coding))
+                response.headers.pop('Content-Length', None)
+            elif isinstance(response.response, DataBody):
+                body = await response.get_data()
+                if len(body) < COMPRESS_MIN_SIZE:
+                    return response
+                response.set_data(compress(body, coding))
+            else:
+                return response
+            mark_encoded(response, coding)
+            return response
+
+
+# ROUTES
+# --------------------Movies----------------
+
+    # Get the movies, one page at a time
+
+    @app.route('/movies')
+    @requires_auth_async('get:movies')
+    @cached_response('movies')
+    async def getAllMovies(payload):
+        async with ReadSession() as session:
+            etag, last_modified = await collection_validators(session, Movie)
+            cached = not_modified(request, etag, last_modified, Response)
+            if cached:
+                return cached
+
+            query = list_query(request, Movie, movie_schema, movie_filters,
+                               MOVIE_SORTS, ('actors',))
+            if query.stream:
+                return add_validators(stream_rows(
+                    query.statement, query.schema, query.include),
+                    etag, last_modified)
+
+            try:
+                movies, next_page = next_cursor(
+                    (await session.execute(query.statement)).all(),
+                    query.sort, query.limit)
+
+                response = jsonify({
+                    'success': True,
+                    'movies': await dump_rows(session, query.schema, movies,
+                                              query.include),
+                    'next': next_page
+                })
+                return add_validators(response, etag, last_modified), 200
+
+            except Exception:
+                abort(401)
+
+    # Get movie by ID
+
+    @app.route('/movies/<int:id>')
+    @requires_auth_async('get:movies')
+    @cached_response('movies')
+    async def getByMovieId(payload, id):
+        include = included(request, ('actors',))
+        schema = fieldset(request, movie_schema)
+        async with ReadSession() as session:
+            try:
+                version = (await session.execute(
+                    version_query(Movie, id))).one_or_none()
+
+                if not version:
+                    return jsonify(
+                        {'success': False, 'error': 'Movie Not Found'}), 404
+
+                etag, last_modified = row_validators(request, version)
+                cached = not_modified(request, etag, last_modified, Response)
+                if cached:
+                    return cached
+
+                movie = (await session.execute(
+                    select(*schema.columns_with('id'))
+                    .where(Movie.id == id))).one()
+                response = jsonify({
+                    'success': True,
+                    'movies': (await dump_rows(session, schema, [movie],
+                                               include))[0]
+                })
+                return add_validators(response, etag, last_modified), 200
+            except Exception:
+                abort(401)
+
+    # Create new Movie
+
+    @app.route('/movies', methods=['POST'])
+    @requires_auth_async('post:movies')
+    @idempotent
+    async def createMovie(payload):
+        return await run_write(create_movie,
+                               await request.get_json(silent=True))
+
+    # Update the existing movie detail
+
+    @app.route('/movies/<int:id>', methods=['PATCH'])
+    @requires_auth_async('patch:movies')
+    async def updateMovie(payload, id):
+        return await run_write(update_movie, id,
+                               await request.get_json(silent=True),
+                               request.if_match)
+
+    # Delete the created movie
+
+    @app.route('/movies/<int:id>', methods=['DELETE'])
+    @requires_auth_async('delete:movies')
+    async def deleteMovie(payload, id):
+        return await run_write(delete_movie, id)
+
+# --------------------------ACTOR--------------------------
+
+    # Get the Actors details, one page at a time
+
+    @app.route('/actors')
+    @requires_auth_async('get:actors')
+    @cached_response('actors')
+    async def getAllActors(payload):
+        async with ReadSession() as session:
+            etag, last_modified = await collection_validators(session, Actor)
+            cached = not_modified(request, etag, last_modified, Response)
+            if cached:
+                return cached
+
+            query = list_query(request, Actor, actor_schema, actor_filters,
+                               ACTOR_SORTS, ('movies',))
+            if query.stream:
+                return add_validators(stream_rows(
+                    query.statement, query.schema, query.include),
+                    etag, last_modified)
+
+            try:
+                actors, next_page = next_cursor(
+                    (await session.execute(query.statement)).all(),
+                    query.sort, query.limit)
+
+                response = jsonify({
+                    'success': True,
+                    'actors': await dump_rows(session, query.schema, actors,
+                                              query.include),
+                    'next': next_page
+                })
+                return add_validators(response, etag, last_modified), 200
+            except Exception:
+                abort(401)
+
+    # Get Actor By ID
+
+    @app.route('/actors/<int:id>')
+    @requires_auth_async('get:actors')
+    @cached_response('actors')
+    async def getByActorId(payload, id):
+        include = included(request, ('movies',))
+        schema = fieldset(request, actor_schema)
+        async with ReadSession() as session:
+            try:
+                version = (await session.execute(
+                    version_query(Actor, id))).one_or_none()
+
+                if not version:
+                    return jsonify(
+                        {'success': False, 'error': 'Actor Not Found'}), 404
+
+                etag, last_modified = row_validators(request, version)
+                cached = not_modified(request, etag, last_modified, Response)
+                if cached:
+                    return cached
+
+                actor = (await session.execute(
+                    select(*schema.columns_with('id'))
+                    .where(Actor.id == id))).one()
+                response = jsonify({
+                    'success': True,
+                    'movies': (await dump_rows(session, schema, [actor],
+                                               include))[0]
+                })
+                return add_validators(response, etag, last_modified), 200
+            except Exception:
+                abort(401)
+
+    # Create new Actor details
+
+    @app.route('/actors', methods=['POST'])
+    @requires_auth_async('post:actors')
+    @idempotent
+    async def createActor(payload):
+        return await run_write(create_actor,
+                               await request.get_json(silent=True))
+
+    # Update the existing Actor details
+
+    @app.route('/actors/<int:id>', methods=['PATCH'])
+    @requires_auth_async('patch:actors')
+    async def updateActor(payload, id):
+        return await run_write(update_actor, id,
+                               await request.get_json(silent=True),
+                               request.if_match)
+
+    # Delete the created Actor details
+
+    @app.route('/actors/<int:id>', methods=['DELETE'])
+    @requires_auth_async('delete:actors')
+    async def deleteActor(payload, id):
+        return await run_write(delete_actor, id)
+
+    register_error_handlers(app)
+
+    return app
+
+
+async def busy(send):
+    # the 503 of middleware.ratelimit.Throttled, sent without an app
+    error = Throttled(503, BUSY_RETRY_AFTER)
+    body = dumps({'success': False, 'error': error.status_code,
+                  'message': error.message})
+    await send({'type': 'http.response.start', 'status': error.status_code,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode()),
+                            (b'retry-after', str(error.retry_after).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+'''
+dispatch(async_app, wsgi_app)
+    ASGI app serving the requests that match a route of async_app with it
+    and passing the other HTTP requests, CORS preflights included, to the
+    Flask wsgi_app in a worker thread. At most MAX_IN_FLIGHT requests are
+    served at once, counted until their last body chunk is sent.
+'''
+
+
+def dispatch(async_app, wsgi_app):
+    fallback = WSGIMiddleware(wsgi_app, workers=WSGI_WORKERS)
+    routes = async_app.url_map.bind('localhost')
+    in_flight = 0
+
+    def is_async(scope):
+        if scope['method'] == 'OPTIONS':
+            return False
+        try:
+            routes.match(scope['path'], method=scope['method'])
+        except Exception:
+            return False
+        return True
+
+    async def serve(scope, receive, send):
+        if scope['type'] == 'http' and not is_async(scope):
+            await fallback(scope, receive, send)
+        else:
+            await async_app(scope, receive, send)
+
+    async def application(scope, receive, send):
+        nonlocal in_flight
+        if not MAX_IN_FLIGHT or scope['type'] != 'http' or \
+                scope['path'] in UNLIMITED_PATHS:
+            return await serve(scope, receive, send)
+        if in_flight >= MAX_IN_FLIGHT:
+            return await busy(send)
+        in_flight += 1
+        try:
+            await serve(scope, receive, send)
+        finally:
+            in_flight -= 1
+
+    return application
+
+
+quart_app = create_asgi_app()
+app = dispatch(quart_app, flask_app)
@@ -1,14 +1,23 @@
-import json
+import asyncio
 import os
 from flask import request
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+
+from auth.jwks import JWKS_URL, JWKSStore, JWKSUnavailable
+from auth.token_cache import TokenCache, VerifiedToken
+from instrumentation.metrics import count_auth
+from instrumentation.profiling import timing
+from middleware.ratelimit import limiter
 
 AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN')
 ALGORITHMS = os.environ.get('ALGORITHMS')
 API_AUDIENCE = os.environ.get('API_AUDIENCE')
 
+jwks_store = JWKSStore(
+    JWKS_URL or f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+token_cache = TokenCache()
+
 # AuthError Exception
 
 class AuthError(Exception):
@@ -19,13 +28,16 @@ class AuthError(Exception):
 
 # Auth Header
 
-def get_token_auth_header():
+def get_token_auth_header(headers=None):
 
-    if 'Authorization' not in request.headers:
+    if headers is None:
+        headers = request.headers
+
+    if 'Authorization' not in headers:
         raise AuthError({"code": "authorization_header_missing",
                         "description": "Authorization header required"}, 401)
 
-    auth_header = request.headers['Authorization']
+    auth_header = headers['Authorization']
 
     headers_parts = auth_header.split(' ')
 
@@ -39,13 +51,16 @@ def get_token_auth_header():
     return headers_parts[1]
 
 
-def check_permissions(permission, payload):
+def check_permissions(permission, verified):
+
+    if not isinstance(verified, VerifiedToken):
+        verified = VerifiedToken(verified)
 
-    if 'permissions' not in payload:
+    if verified.permissions is None:
         raise AuthError({"code": "permission_not_granted",
                         "description": "permissions not found"}, 400)
 
-    if permission not in payload['permissions']:
+    if permission not in verified.permissions:
         raise AuthError({"code": "invalid permission",
                         "description": "permissions forbidden"}, 403)
 
@@ -53,25 +68,21 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    try:
+        with timing('jwks'):
+            rsa_key = jwks_store.get_key(unverified_header['kid'])
+    except JWKSUnavailable:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to load the signing keys.'
+        }, 503)
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -110,10 +121,46 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
+            with timing('auth'):
+                token = get_token_auth_header()
+            verified = token_cache.get(token)
+            if verified is None:
+                # includes the jwks phase
+                with timing('jwt'):
+                    verified = token_cache.put(token,
+                                               verify_decode_jwt(token))
+            check_permissions(permission, verified)
+            count_auth('ok')
+            limiter.check(permission, verified.payload)
+            return f(verified.payload, *args, **kwargs)
+
+        return wrapper
+    return requires_auth_decorator
+
+
+# Async (asgi.py)
+
+async def verify_decode_jwt_async(token):
+    # JWKS fetches and signature checks block, so they run in a worker
+    # thread instead of on the event loop
+    return await asyncio.to_thread(verify_decode_jwt, token)
+
+
+def requires_auth_async(permission=''):
+    def requires_auth_decorator(f):
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            from quart import request
+
+            token = get_token_auth_header(request.headers)
+            verified = token_cache.get(token)
+            if verified is None:
+                verified = token_cache.put(
+                    token, await verify_decode_jwt_async(token))
+            check_permissions(permission, verified)
+            count_auth('ok')
+            limiter.check(permission, verified.payload)
+            return await f(verified.payload, *args, **kwargs)
 
         return wrapper
     return requires_auth_decorator
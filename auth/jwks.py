@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import threading
+import time
+from urllib.request import urlopen
+
+# Where to load the key set from. Accepts an http(s):// or file:// URL, or a
+# plain filesystem path, so a local stand-in can replace the Auth0 endpoint.
+JWKS_URL = os.environ.get('JWKS_URL')
+# Seconds a fetched key set is considered fresh.
+JWKS_TTL = float(os.environ.get('JWKS_TTL', 600))
+# Minimum seconds between fetches triggered by an unknown kid.
+JWKS_MIN_REFRESH_INTERVAL = float(
+    os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_TIMEOUT = float(os.environ.get('JWKS_TIMEOUT', 5))
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSUnavailable(Exception):
+    pass
+
+
+'''
+JWKSStore
+    In-process cache of the identity provider's signing keys, indexed by kid.
+
+    The key set is fetched on first use. Once it is older than the TTL it keeps
+    being served while a background thread refreshes it. An unknown kid
+    triggers one forced refresh shared by every request waiting on it (and no
+    more than one per min_refresh_interval). A failed refresh keeps the last
+    good key set.
+'''
+
+
+class JWKSStore:
+    def __init__(self, url, ttl=JWKS_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                 timeout=JWKS_TIMEOUT):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._generation = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if '://' not in self.url:
+            with open(self.url, 'rb') as f:
+                return f.read()
+        with urlopen(self.url, timeout=self.timeout) as response:
+            return response.read()
+
+    def _fetch_locked(self):
+        self._last_attempt = time.monotonic()
+        jwks = json.loads(self._read())
+        self._keys = {
+            key['kid']: {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use'),
+                'n': key['n'],
+                'e': key['e']
+            }
+            for key in jwks['keys'] if 'kid' in key
+        }
+        self._fetched_at = time.monotonic()
+        self._generation += 1
+
+    def refresh(self, force=False):
+        '''
+        Fetch the key set unless another thread completed a fetch while this
+        one was waiting for the lock. Returns False if the fetch failed.
+        '''
+        generation = self._generation
+        with self._lock:
+            if self._generation != generation:
+                return True
+            if (not force and self._last_attempt is not None and
+                    time.monotonic() - self._last_attempt <
+                    self.min_refresh_interval):
+                return False
+            try:
+                self._fetch_locked()
+                return True
+            except Exception:
+                logger.warning('JWKS refresh from %s failed', self.url,
+                               exc_info=True)
+                return False
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            self._refreshing = False
+
+    def _ensure_fresh(self):
+        if self._fetched_at is None:
+            if not self.refresh() and self._fetched_at is None:
+                raise JWKSUnavailable(self.url)
+            return
+
+        if (time.monotonic() - self._fetched_at > self.ttl and
+                not self._refreshing):
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background,
+                             daemon=True).start()
+
+    def get_key(self, kid):
+        '''
+        Return the RSA key for kid, or None if the provider does not publish
+        it. Raises JWKSUnavailable if no key set has ever been loaded.
+        '''
+        self._ensure_fresh()
+        key = self._keys.get(kid)
+        if key is None and self.refresh():
+            key = self._keys.get(kid)
+        return key
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Maximum number of verified tokens kept; 0 disables the cache.
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+# Upper bound in seconds on how long a verified token is reused, on top of
+# its own exp claim.
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', 600))
+
+
+'''
+VerifiedToken
+    The claims of a token that passed signature and claims verification,
+    with its permissions precomputed as a frozenset (None when the token has
+    no permissions claim).
+'''
+
+
+class VerifiedToken:
+    __slots__ = ('payload', 'permissions', 'expires_at')
+
+    def __init__(self, payload, expires_at=None):
+        self.payload = payload
+        permissions = payload.get('permissions')
+        self.permissions = (frozenset(permissions)
+                            if permissions is not None else None)
+        self.expires_at = expires_at
+
+
+'''
+TokenCache
+    Bounded LRU of VerifiedToken entries keyed by the SHA-256 digest of the
+    raw token. An entry never outlives the token's exp claim.
+'''
+
+
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        if self.maxsize <= 0:
+            return None
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, token, payload):
+        expires_at = time.time() + self.ttl
+        if 'exp' in payload:
+            expires_at = min(expires_at, float(payload['exp']))
+        entry = VerifiedToken(payload, expires_at)
+        if self.maxsize <= 0:
+            return entry
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize
+        }
@@ -0,0 +1,104 @@
+import os
+import random
+from datetime import date, timedelta
+
+ADJECTIVES = ['Silent', 'Crimson', 'Last', 'Golden', 'Broken', 'Hidden',
+              'Electric', 'Frozen', 'Wild', 'Distant', 'Midnight', 'Iron',
+              'Lost', 'Bright', 'Savage', 'Quiet', 'Burning', 'Hollow',
+              'Northern', 'Secret']
+NOUNS = ['River', 'Empire', 'Garden', 'Signal', 'Harbor', 'Kingdom',
+         'Machine', 'Shadow', 'Voyage', 'Orchard', 'Frontier', 'Mirror',
+         'Station', 'Tide', 'Circus', 'Fortress', 'Horizon', 'Lantern',
+         'Canyon', 'Legacy']
+FIRST_NAMES = ['Ava', 'Liam', 'Maya', 'Noah', 'Zoe', 'Omar', 'Ines', 'Kai',
+               'Lena', 'Theo', 'Nia', 'Hugo', 'Sara', 'Ravi', 'Mila', 'Jon']
+LAST_NAMES = ['Stone', 'Rivera', 'Okafor', 'Lindqvist', 'Tanaka', 'Moreau',
+              'Novak', 'Haddad', 'Fischer', 'Costa', 'Walsh', 'Ibrahim']
+GENDERS = ['female', 'male', 'non-binary']
+
+# Rows per insert_many call while seeding.
+SEED_BATCH = 10000
+# Actors cast in each seeded movie.
+CAST_PER_MOVIE = 2
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'migrations')
+
+
+def title(rnd, i):
+    return f'{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)} {i}'
+
+
+def name(rnd):
+    return f'{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}'
+
+
+def movie_rows(rnd, start, count):
+    return [{'title': title(rnd, i),
+             'release_date': date(1950, 1, 1) +
+             timedelta(days=rnd.randrange(75 * 365))}
+            for i in range(start, start + count)]
+
+
+def actor_rows(rnd, count):
+    return [{'name': name(rnd), 'age': rnd.randrange(18, 90),
+             'gender': rnd.choice(GENDERS)}
+            for _ in range(count)]
+
+
+'''
+Fixture
+    ids of the seeded rows the routes draw from. The last `spare` movies
+    and actors are set aside for the DELETE routes, which consume each of
+    them once, so that the other routes never hit a deleted row.
+'''
+
+
+class Fixture:
+    def __init__(self, movie_ids, actor_ids, cast, spare):
+        self.movies = movie_ids[:len(movie_ids) - spare]
+        self.actors = actor_ids[:len(actor_ids) - spare]
+        self.spare_movies = iter(movie_ids[len(movie_ids) - spare:])
+        self.spare_actors = iter(actor_ids[len(actor_ids) - spare:])
+        self.cast = iter(cast)
+
+
+def prepare(app, scale, spare, reuse=False, seed=0):
+    '''
+    Brings the database of app to the latest migration and seeds scale
+    movies and actors (plus spare of each), CAST_PER_MOVIE actors per movie,
+    through the app's own bulk insert path. An already seeded database is
+    only used as it is when reuse is set.
+    '''
+    from flask_migrate import upgrade
+    from sqlalchemy import func, insert, select
+
+    from database.models import Actor, Cast, Movie, db
+
+    rnd = random.Random(seed)
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+        seeded = db.session.scalar(select(func.count()).select_from(Movie))
+        if seeded and not reuse:
+            raise SystemExit(
+                f'{db.engine.url!r} already holds {seeded} movies; '
+                'pass --reuse to benchmark them as they are')
+        if not seeded:
+            total = scale + spare
+            for start in range(0, total, SEED_BATCH):
+                count = min(SEED_BATCH, total - start)
+                movie_ids = Movie.insert_many(movie_rows(rnd, start, count))
+                actor_ids = Actor.insert_many(actor_rows(rnd, count))
+                per_movie = min(CAST_PER_MOVIE, count)
+                db.session.execute(insert(Cast), [
+                    {'movie_id': movie_id, 'actor_id': actor_id}
+                    for movie_id in movie_ids
+                    for actor_id in rnd.sample(actor_ids, per_movie)])
+                db.session.commit()
+
+        movie_ids = db.session.scalars(select(Movie.id).order_by(Movie.id))
+        actor_ids = db.session.scalars(select(Actor.id).order_by(Actor.id))
+        cast = db.session.execute(
+            select(Cast.movie_id, Cast.actor_id).limit(spare)).all()
+        return Fixture(movie_ids.all(), actor_ids.all(),
+                       [tuple(row) for row in cast], spare)
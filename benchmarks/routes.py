@@ -0,0 +1,101 @@
+from collections import namedtuple
+from datetime import date, timedelta
+from urllib.parse import quote
+
+from benchmarks.fixtures import (ADJECTIVES, GENDERS, NOUNS, actor_rows,
+                                 movie_rows, name)
+
+'''
+Route
+    One benchmarked request shape. rule is the app.py rule it exercises (the
+    key of the server's query counts); build(rnd, fixture) returns the path
+    and JSON body of one request. headers are sent with every request.
+'''
+Route = namedtuple('Route', 'name method rule build headers',
+                   defaults=(None,))
+
+# The updates are unconditional: concurrent clients picking the same row
+# would otherwise mostly measure 412s.
+ANY_VERSION = {'If-Match': '*'}
+
+
+def _window(rnd):
+    starts = date(2024, 1, 1) + timedelta(days=rnd.randrange(365))
+    return starts, starts + timedelta(days=rnd.randrange(1, 60))
+
+
+def _available(rnd, fixture):
+    starts, ends = _window(rnd)
+    return f'/actors/available?from={starts}&to={ends}&limit=20', None
+
+
+def _stream(rnd, fixture):
+    prefix = f'{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)}'
+    return f'/movies?stream=1&title_prefix={quote(prefix)}', None
+
+
+# In run order: the writes come after the reads they would disturb, and
+# the DELETE routes, which consume the spare rows, come last.
+ROUTES = [
+    Route('list movies', 'GET', '/movies',
+          lambda rnd, f: ('/movies?limit=20&sort=-release_date', None)),
+    Route('list movies with cast', 'GET', '/movies',
+          lambda rnd, f: ('/movies?limit=20&include=actors', None)),
+    Route('stream movies', 'GET', '/movies', _stream),
+    Route('get movie', 'GET', '/movies/<int:id>',
+          lambda rnd, f: (f'/movies/{rnd.choice(f.movies)}', None)),
+    Route('list actors', 'GET', '/actors',
+          lambda rnd, f: (f'/actors?limit=20&gender={rnd.choice(GENDERS)}'
+                          f'&age_min={rnd.randrange(18, 60)}', None)),
+    Route('available actors', 'GET', '/actors/available', _available),
+    Route('get actor', 'GET', '/actors/<int:id>',
+          lambda rnd, f: (f'/actors/{rnd.choice(f.actors)}', None)),
+    Route('search', 'GET', '/search',
+          lambda rnd, f: (f'/search?q={rnd.choice(NOUNS).lower()}', None)),
+    Route('movie stats', 'GET', '/stats/movies',
+          lambda rnd, f: ('/stats/movies', None)),
+    Route('actor stats', 'GET', '/stats/actors',
+          lambda rnd, f: ('/stats/actors', None)),
+    Route('metrics', 'GET', '/metrics',
+          lambda rnd, f: ('/metrics', None)),
+    Route('create movie', 'POST', '/movies',
+          lambda rnd, f: ('/movies', {k: str(v) for k, v in
+                                      movie_rows(rnd, 0, 1)[0].items()})),
+    Route('create movies in bulk', 'POST', '/movies/bulk',
+          lambda rnd, f: ('/movies/bulk', [{k: str(v) for k, v in
+                                            row.items()} for row in
+                                           movie_rows(rnd, 0, 50)])),
+    Route('update movie', 'PATCH', '/movies/<int:id>',
+          lambda rnd, f: (f'/movies/{rnd.choice(f.movies)}',
+                          {'title': movie_rows(rnd, 0, 1)[0]['title']}),
+          ANY_VERSION),
+    Route('create actor', 'POST', '/actors',
+          lambda rnd, f: ('/actors', actor_rows(rnd, 1)[0])),
+    Route('create actors in bulk', 'POST', '/actors/bulk',
+          lambda rnd, f: ('/actors/bulk', actor_rows(rnd, 50))),
+    Route('update actor', 'PATCH', '/actors/<int:id>',
+          lambda rnd, f: (f'/actors/{rnd.choice(f.actors)}',
+                          {'name': name(rnd)}), ANY_VERSION),
+    Route('assign actor', 'PUT', '/movies/<int:id>/actors/<int:actor_id>',
+          lambda rnd, f: (f'/movies/{rnd.choice(f.movies)}/actors/'
+                          f'{rnd.choice(f.actors)}', None)),
+    Route('unassign actor', 'DELETE',
+          '/movies/<int:id>/actors/<int:actor_id>',
+          lambda rnd, f: ('/movies/{}/actors/{}'.format(*next(f.cast)),
+                          None)),
+    Route('delete movie', 'DELETE', '/movies/<int:id>',
+          lambda rnd, f: (f'/movies/{next(f.spare_movies)}', None)),
+    Route('delete actor', 'DELETE', '/actors/<int:id>',
+          lambda rnd, f: (f'/actors/{next(f.spare_actors)}', None)),
+]
+
+
+def uncovered(app):
+    '''
+    The (method, rule) pairs of app's routes no benchmark exercises.
+    '''
+    covered = {(route.method, route.rule) for route in ROUTES}
+    return sorted((method, rule.rule) for rule in app.url_map.iter_rules()
+                  for method in rule.methods - {'HEAD', 'OPTIONS'}
+                  if rule.endpoint != 'static'
+                  and (method, rule.rule) not in covered)
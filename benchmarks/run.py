@@ -0,0 +1,278 @@
+'''
+Benchmark suite
+
+    python -m benchmarks.run --scale 10000 --requests 500 --concurrency 8
+
+Seeds a database (a fresh SQLite file unless --database is given), starts
+app.py in a child process and drives every route with concurrent
+keep-alive clients, one route at a time. Tokens are signed by a local RSA
+key whose JWKS is served on localhost, so neither Auth0 nor the expired
+tokens of constants.py are involved. Writes a JSON report: throughput,
+latency percentiles, SQL statements per request and the server's peak RSS
+for each route.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.client import HTTPConnection, HTTPException
+from itertools import count
+from random import Random
+from urllib.parse import urlsplit
+
+from benchmarks.signer import LocalSigner, serve_jwks
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.run',
+        description='Benchmark every route of app.py.')
+    parser.add_argument('--database', help='database URL to seed and serve '
+                        '(default: a new SQLite file)')
+    parser.add_argument('--scale', type=int, default=1000,
+                        help='movies and actors to seed (default 1000)')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='measured requests per route (default 200)')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='unmeasured requests per route first '
+                        '(default 20)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='concurrent clients (default 8)')
+    parser.add_argument('--routes', nargs='*', default=(),
+                        help='only the routes whose name contains one of '
+                        'these')
+    parser.add_argument('--url', help='benchmark a server started '
+                        'separately instead (no query counts or RSS); it '
+                        'must use the same database and the JWKS served '
+                        'on --jwks-port')
+    parser.add_argument('--jwks-port', type=int, default=0)
+    parser.add_argument('--key', help='file keeping the signing key between '
+                        'runs (default: a new key per run)')
+    parser.add_argument('--reuse', action='store_true',
+                        help='benchmark an already seeded database')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed of the data and the requests')
+    parser.add_argument('--output', default='-',
+                        help='JSON report file (default: stdout)')
+    parser.add_argument('--allow-errors', action='store_true',
+                        help='exit with 0 even if some route answered '
+                        'with a status other than 2xx')
+    return parser.parse_args(argv)
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+'''
+drive(url, route, fixture, tokens, total, seed)
+    sends total requests of route from one thread per token, each on its
+    own keep-alive connection; returns the latencies in seconds, the status
+    code counts and the wall time
+'''
+
+
+def drive(url, route, fixture, tokens, total, seed):
+    target = urlsplit(url)
+    numbers = count()
+    latencies = [[] for _ in tokens]
+    statuses = [Counter() for _ in tokens]
+
+    def client(i):
+        rnd = Random(seed * 7919 + i)
+        connection = HTTPConnection(target.hostname, target.port, timeout=60)
+        headers = {'Authorization': f'Bearer {tokens[i]}',
+                   **(route.headers or {})}
+        while next(numbers) < total:
+            path, body = route.build(rnd, fixture)
+            if body is not None:
+                body = json.dumps(body).encode()
+                headers['Content-Type'] = 'application/json'
+            started = time.perf_counter()
+            try:
+                connection.request(route.method, path, body=body,
+                                   headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, HTTPException):
+                connection.close()
+                status = 'error'
+            latencies[i].append(time.perf_counter() - started)
+            statuses[i][status] += 1
+            headers.pop('Content-Type', None)
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(i,))
+               for i in range(len(tokens))]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return (sorted(latency for each in latencies for latency in each),
+            sum(statuses, Counter()), elapsed)
+
+
+def failed(statuses):
+    # connection errors are counted under 'error'
+    return sum(n for status, n in statuses.items()
+               if status == 'error' or not 200 <= status < 300)
+
+
+def report(route, latencies, statuses, elapsed, before, after):
+    ms = [latency * 1000 for latency in latencies]
+    result = {
+        'route': route.name,
+        'method': route.method,
+        'rule': route.rule,
+        'requests': len(ms),
+        'statuses': {str(status): n for status, n in statuses.items()},
+        'failed': failed(statuses),
+        'throughput_rps': round(len(ms) / elapsed, 1),
+        'latency_ms': {
+            'mean': round(sum(ms) / len(ms), 2),
+            'p50': round(percentile(ms, 50), 2),
+            'p90': round(percentile(ms, 90), 2),
+            'p99': round(percentile(ms, 99), 2),
+            'max': round(ms[-1], 2),
+        },
+        'queries_per_request': None,
+        'peak_rss_mb': None,
+    }
+    if after is not None:
+        key = f'{route.method} {route.rule}'
+        served = (after['requests'].get(key, 0) -
+                  before['requests'].get(key, 0))
+        if served:
+            result['queries_per_request'] = round(
+                (after['queries'].get(key, 0) -
+                 before['queries'].get(key, 0)) / served, 2)
+        result['peak_rss_mb'] = round(after['peak_rss_kb'] / 1024, 1)
+    return result
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='casting-bench-')
+    os.environ['DATABASE_URL'] = (args.database or
+                                  f'sqlite:///{workdir}/bench.sqlite')
+    os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+    os.environ.setdefault('API_AUDIENCE', 'casting-agency')
+    os.environ.setdefault('ALGORITHMS', 'RS256')
+    # the metrics route is benchmarked too (served on localhost only)
+    os.environ.setdefault('METRICS', '1')
+
+    signer = LocalSigner(os.environ['AUTH0_DOMAIN'],
+                         os.environ['API_AUDIENCE'], key_path=args.key)
+    os.environ['JWKS_URL'] = serve_jwks(signer, port=args.jwks_port)
+    print(f'JWKS at {os.environ["JWKS_URL"]}', file=sys.stderr)
+
+    from app import app
+    from benchmarks.fixtures import prepare
+    from benchmarks.routes import ROUTES, uncovered
+    from database.models import db
+
+    routes = [route for route in ROUTES
+              if not args.routes or any(part in route.name
+                                        for part in args.routes)]
+    spare = args.requests + args.warmup
+    started = time.perf_counter()
+    fixture = prepare(app, args.scale, spare, reuse=args.reuse,
+                      seed=args.seed)
+    print(f'seeded in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    tokens = [signer.token(f'bench-client-{i}')
+              for i in range(args.concurrency)]
+
+    server = conn = None
+    url = args.url
+    if url is None:
+        from benchmarks.server import serve
+
+        context = multiprocessing.get_context('spawn')
+        conn, child_conn = context.Pipe()
+        server = context.Process(target=serve, args=(child_conn,),
+                                 daemon=True)
+        server.start()
+        url = f'http://127.0.0.1:{conn.recv()}'
+
+    def server_snapshot(message='snapshot'):
+        if conn is None:
+            return None
+        conn.send(message)
+        return conn.recv()
+
+    results = []
+    try:
+        for route in routes:
+            drive(url, route, fixture, tokens, args.warmup, args.seed)
+            before = server_snapshot()
+            latencies, statuses, elapsed = drive(
+                url, route, fixture, tokens, args.requests, args.seed + 1)
+            results.append(report(route, latencies, statuses, elapsed,
+                                  before, server_snapshot()))
+            print(f'{route.name:24} {results[-1]["throughput_rps"]:>9} req/s'
+                  f'  p99 {results[-1]["latency_ms"]["p99"]} ms',
+                  file=sys.stderr)
+            if results[-1]['failed']:
+                print(f'warning: {route.name}: {results[-1]["failed"]} of '
+                      f'{results[-1]["requests"]} requests not 2xx '
+                      f'{results[-1]["statuses"]}', file=sys.stderr)
+        final = server_snapshot('stop')
+    finally:
+        if server is not None:
+            server.join(timeout=10)
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    output = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'database': dialect,
+            'scale': args.scale,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+            'target': args.url or 'werkzeug',
+        },
+        'routes': results,
+        'peak_rss_mb': (round(final['peak_rss_kb'] / 1024, 1)
+                        if final else None),
+        'uncovered': [' '.join(pair) for pair in uncovered(app)],
+        'failed_routes': [result['route'] for result in results
+                          if result['failed']],
+    }
+    text = json.dumps(output, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    # their throughput measures error responses, not the route
+    if output['failed_routes'] and not args.allow_errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
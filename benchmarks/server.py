@@ -0,0 +1,66 @@
+import resource
+import threading
+from collections import Counter
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def snapshot(requests, queries):
+    return {'requests': dict(requests), 'queries': dict(queries),
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+'''
+serve(conn, host)
+    Child process entry point of run.py: serves app.py with werkzeug's
+    threaded server, counting the requests and SQL statements of each route.
+    Sends the port once listening, then answers every 'snapshot' message
+    on conn with the counts so far and the peak RSS, until 'stop'.
+'''
+
+
+def serve(conn, host='127.0.0.1'):
+    from flask import g, has_request_context, request
+    from sqlalchemy import event
+
+    from app import app
+    from database.models import db
+
+    requests = Counter()
+    queries = Counter()
+    lock = threading.Lock()
+
+    def count_query(*args):
+        if has_request_context():
+            g.bench_queries = g.get('bench_queries', 0) + 1
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', count_query)
+
+    # after streamed bodies too: the stream keeps the request context
+    @app.teardown_request
+    def count_request(exception):
+        rule = request.url_rule.rule if request.url_rule else None
+        key = f'{request.method} {rule}'
+        with lock:
+            requests[key] += 1
+            queries[key] += g.get('bench_queries', 0)
+
+    server = make_server(host, 0, app, threaded=True,
+                         request_handler=KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    conn.send(server.port)
+    while conn.recv() != 'stop':
+        with lock:
+            conn.send(snapshot(requests, queries))
+    server.shutdown()
+    with lock:
+        conn.send(snapshot(requests, queries))
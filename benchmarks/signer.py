@@ -0,0 +1,84 @@
+import base64
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import rsa
+from jose import jwt
+
+# Every permission the routes of app.py check.
+PERMISSIONS = ['get:movies', 'get:actors', 'post:movies', 'post:actors',
+               'patch:movies', 'patch:actors', 'delete:movies',
+               'delete:actors']
+
+
+def _b64(number):
+    raw = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+'''
+LocalSigner
+    Stands in for Auth0: an RSA key generated on the spot (or loaded from
+    key_path, so that a server started separately keeps trusting it across
+    runs) that mints RS256 tokens with the issuer and audience the app
+    expects, and publishes its public half as a JWKS.
+'''
+
+
+class LocalSigner:
+    def __init__(self, domain, audience, kid='bench', key_path=None):
+        self.issuer = f'https://{domain}/'
+        self.audience = audience
+        self.kid = kid
+        if key_path and os.path.exists(key_path):
+            with open(key_path, 'rb') as f:
+                self.private_key = rsa.PrivateKey.load_pkcs1(f.read())
+        else:
+            _, self.private_key = rsa.newkeys(2048)
+            if key_path:
+                with open(key_path, 'wb') as f:
+                    f.write(self.private_key.save_pkcs1())
+        self._pem = self.private_key.save_pkcs1().decode()
+
+    def jwks(self):
+        return {'keys': [{'kty': 'RSA', 'kid': self.kid, 'use': 'sig',
+                          'alg': 'RS256', 'n': _b64(self.private_key.n),
+                          'e': _b64(self.private_key.e)}]}
+
+    def token(self, subject, permissions=PERMISSIONS, expires_in=86400):
+        now = int(time.time())
+        return jwt.encode({'iss': self.issuer, 'aud': self.audience,
+                           'sub': subject, 'iat': now,
+                           'exp': now + expires_in,
+                           'permissions': list(permissions)},
+                          self._pem, algorithm='RS256',
+                          headers={'kid': self.kid})
+
+
+'''
+serve_jwks(signer, host, port)
+    serves the signer's key set on every GET path from a daemon thread and
+    returns the URL to set as JWKS_URL
+'''
+
+
+def serve_jwks(signer, host='127.0.0.1', port=0):
+    body = json.dumps(signer.jwks()).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://{host}:{server.server_address[1]}/.well-known/jwks.json'
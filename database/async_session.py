@@ -0,0 +1,38 @@
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database.models import database_path, engine_options
+
+# Async driver of each database, used by the ASGI app (asgi.py).
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_url(url):
+    '''
+    DATABASE_URL with its driver swapped for the async one. asyncpg takes
+    ssl instead of libpq's sslmode (Render's URLs carry sslmode=require).
+    '''
+    url = make_url(url)
+    url = url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+    if url.get_backend_name() == 'postgresql' and 'sslmode' in url.query:
+        url = url.update_query_dict(
+            {'ssl': url.query['sslmode']}).difference_update_query(
+            ['sslmode'])
+    return url
+
+
+'''
+make_async_session(database_path)
+    returns a factory of AsyncSession bound to a new async engine, with the
+    DB_* engine options; sessions keep their objects loaded after commit, as
+    the async handlers serialize them afterwards
+'''
+
+
+def make_async_session(database_path=database_path):
+    url = async_database_url(database_path)
+    engine = create_async_engine(url, **engine_options(url))
+    return async_sessionmaker(engine, expire_on_commit=False)
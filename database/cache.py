@@ -0,0 +1,338 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+# memory (default), redis or none
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_URL = os.environ.get('CACHE_URL', 'redis://localhost:6379/0')
+# Maximum number of entries of the in-process backend.
+CACHE_SIZE = int(os.environ.get('CACHE_SIZE', 4096))
+# Seconds a cached response is served before it is recomputed.
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 60))
+# Seconds a worker holds the lock while computing a missing entry.
+CACHE_LOCK_TTL = float(os.environ.get('CACHE_LOCK_TTL', 10))
+# Generation tokens (see ResponseCache) outlive the entries keyed by them.
+GENERATION_TTL_FACTOR = 10
+
+
+'''
+LRUBackend
+    In-process byte store with per-entry expiry, evicting the least recently
+    used entry beyond maxsize.
+'''
+
+
+class LRUBackend:
+    shared = False
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set_locked(self, key, value, ttl):
+        self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set_locked(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or
+                                      entry[1] > time.monotonic()):
+                return False
+            self._set_locked(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+'''
+RedisBackend
+    Wraps a client exposing the redis-py get/set(ex=, nx=)/delete calls, so a
+    local fake can stand in for Redis in tests.
+'''
+
+
+class RedisBackend:
+    shared = True
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=int(ttl) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, value, ex=int(ttl) if ttl else None,
+                                    nx=True))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+'''
+CachedResponse
+    A 200 response body together with its ETag and Last-Modified validators.
+'''
+
+
+class CachedResponse:
+    __slots__ = ('body', 'etag', 'last_modified')
+
+    def __init__(self, body, etag, last_modified):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def dumps(self):
+        last_modified = (self.last_modified.isoformat()
+                         if self.last_modified else '')
+        return b'\n'.join([self.etag.encode(), last_modified.encode(),
+                           self.body])
+
+    @classmethod
+    def loads(cls, raw):
+        etag, last_modified, body = raw.split(b'\n', 2)
+        return cls(body, etag.decode(),
+                   datetime.fromisoformat(last_modified.decode())
+                   if last_modified else None)
+
+
+'''
+ResponseCache
+    Read-through cache of serialized responses, per resource and per list
+    page. Keys embed a generation token of the resource and of its
+    collection; invalidate() replaces both tokens, so every cached variant of
+    the resource and every cached page of the collection stop being read at
+    once. A missing entry is computed by one caller only: others wait on a
+    striped in-process lock and, with a shared backend, on a lock key, until
+    the entry is stored or the key is released without one.
+    Generation tokens expire GENERATION_TTL_FACTOR times later than entries,
+    so that unused ones do not pile up. One that expires (or is evicted) is
+    replaced by a new random token, which at worst turns the entries under
+    the old one into misses.
+'''
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=CACHE_TTL, lock_ttl=CACHE_LOCK_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.generation_ttl = ttl * GENERATION_TTL_FACTOR
+        self.lock_ttl = lock_ttl
+        self.hits = 0
+        self.misses = 0
+        self._locks = [threading.Lock() for _ in range(64)]
+        self._async_locks = None
+
+    def _generation(self, name):
+        key = f'gen:{name}'
+        generation = self.backend.get(key)
+        if generation is None:
+            generation = uuid.uuid4().hex.encode()
+            if not self.backend.add(key, generation, self.generation_ttl):
+                generation = self.backend.get(key) or generation
+        return generation.decode()
+
+    def key(self, kind, id, variant):
+        collection = self._generation(kind)
+        if id is None:
+            return f'{kind}:{collection}:{variant}'
+        resource = self._generation(f'{kind}:{id}')
+        return f'{kind}:{id}:{collection}:{resource}:{variant}'
+
+    def invalidate(self, kind, id=None):
+        self.backend.set(f'gen:{kind}', uuid.uuid4().hex.encode(),
+                         self.generation_ttl)
+        if id is not None:
+            self.backend.set(f'gen:{kind}:{id}', uuid.uuid4().hex.encode(),
+                             self.generation_ttl)
+
+    def on_write(self, kind, event, rows):
+        '''Write listener (see database.models.notify_write).'''
+        if event == 'insert':
+            self.invalidate(kind)
+            return
+        for row in rows:
+            self.invalidate(kind, row['id'])
+
+    def _load(self, key):
+        raw = self.backend.get(key)
+        return CachedResponse.loads(raw) if raw is not None else None
+
+    def get_or_set(self, key, compute, store=True):
+        '''
+        Returns the cached entry for key, calling compute() on a miss.
+        compute returns a CachedResponse to store, or any other value to
+        hand back to the caller without caching it. Without store, a miss
+        is computed but not stored.
+        '''
+        entry = self._load(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        if not store:
+            self.misses += 1
+            return compute()
+
+        with self._locks[hash(key) % len(self._locks)]:
+            entry = self._load(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+            lock_key = f'lock:{key}'
+            locked = self.backend.shared and self.backend.add(
+                lock_key, b'1', self.lock_ttl)
+            if self.backend.shared and not locked:
+                deadline = time.monotonic() + self.lock_ttl
+                while time.monotonic() < deadline:
+                    time.sleep(0.01)
+                    entry = self._load(key)
+                    if entry is not None:
+                        return entry
+                    if self.backend.get(lock_key) is None:
+                        # released without storing: not cacheable
+                        break
+
+            try:
+                result = compute()
+                if isinstance(result, CachedResponse):
+                    self.backend.set(key, result.dumps(), self.ttl)
+                return result
+            finally:
+                if locked:
+                    self.backend.delete(lock_key)
+
+    async def get_or_set_async(self, key, compute, store=True):
+        '''
+        get_or_set for the async app: compute is a coroutine function, and
+        concurrent misses wait on asyncio locks instead of thread locks.
+        '''
+        entry = self._load(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        if not store:
+            self.misses += 1
+            return await compute()
+
+        if self._async_locks is None:
+            self._async_locks = [asyncio.Lock() for _ in range(64)]
+        async with self._async_locks[hash(key) % len(self._async_locks)]:
+            entry = self._load(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+            lock_key = f'lock:{key}'
+            locked = self.backend.shared and self.backend.add(
+                lock_key, b'1', self.lock_ttl)
+            if self.backend.shared and not locked:
+                deadline = time.monotonic() + self.lock_ttl
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(0.01)
+                    entry = self._load(key)
+                    if entry is not None:
+                        return entry
+                    if self.backend.get(lock_key) is None:
+                        # released without storing: not cacheable
+                        break
+
+            try:
+                result = await compute()
+                if isinstance(result, CachedResponse):
+                    self.backend.set(key, result.dumps(), self.ttl)
+                return result
+            finally:
+                if locked:
+                    self.backend.delete(lock_key)
+
+    def encoded(self, key, entry, coding, encode):
+        '''
+        The body of entry, cached under key, as encode(body) computes it
+        for the content coding coding; stored beside entry on first use.
+        '''
+        variant = f'{key}:{entry.etag}:{coding}'
+        body = self.backend.get(variant)
+        if body is None:
+            body = encode(entry.body)
+            self.backend.set(variant, body, self.ttl)
+        return body
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class NullCache:
+    '''Stands in for ResponseCache when CACHE_BACKEND is none.'''
+
+    def key(self, kind, id, variant):
+        return None
+
+    def invalidate(self, kind, id=None):
+        pass
+
+    def on_write(self, kind, event, rows):
+        pass
+
+    def get_or_set(self, key, compute, store=True):
+        return compute()
+
+    async def get_or_set_async(self, key, compute, store=True):
+        return await compute()
+
+    def encoded(self, key, entry, coding, encode):
+        return encode(entry.body)
+
+    def stats(self):
+        return {'hits': 0, 'misses': 0}
+
+
+def make_cache():
+    if CACHE_BACKEND == 'none':
+        return NullCache()
+    if CACHE_BACKEND == 'redis':
+        return ResponseCache(RedisBackend.from_url(CACHE_URL))
+    return ResponseCache(LRUBackend())
+
+
+response_cache = make_cache()
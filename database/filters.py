@@ -0,0 +1,68 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from database.models import Actor, Movie
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+'''
+movie_filters(args) / actor_filters(args)
+    Compile the filter query parameters of a list request into SQLAlchemy
+    conditions. Values are bound as parameters and every condition matches
+    one of the catalog indexes:
+        movies: release_date_from, release_date_to, title_prefix
+        actors: gender, age_min, age_max, name_prefix
+    Raise InvalidFilter on a malformed value.
+'''
+
+
+def _date(args, name):
+    try:
+        return date.fromisoformat(args[name])
+    except ValueError:
+        raise InvalidFilter(f'{name} must be YYYY-MM-DD')
+
+
+def _number(args, name):
+    try:
+        value = Decimal(args[name])
+    except InvalidOperation:
+        raise InvalidFilter(f'{name} must be a number')
+    # Decimal also parses NaN and Infinity, which no age compares to
+    if not value.is_finite():
+        raise InvalidFilter(f'{name} must be a number')
+    return value
+
+
+def _prefix(column, prefix):
+    escaped = (prefix.replace('\\', '\\\\').replace('%', '\\%')
+               .replace('_', '\\_'))
+    return column.like(escaped + '%', escape='\\')
+
+
+def movie_filters(args):
+    conditions = []
+    if 'release_date_from' in args:
+        conditions.append(
+            Movie.release_date >= _date(args, 'release_date_from'))
+    if 'release_date_to' in args:
+        conditions.append(Movie.release_date <= _date(args, 'release_date_to'))
+    if args.get('title_prefix'):
+        conditions.append(_prefix(Movie.title, args['title_prefix']))
+    return conditions
+
+
+def actor_filters(args):
+    conditions = []
+    if args.get('gender'):
+        conditions.append(Actor.gender == args['gender'])
+    if 'age_min' in args:
+        conditions.append(Actor.age >= _number(args, 'age_min'))
+    if 'age_max' in args:
+        conditions.append(Actor.age <= _number(args, 'age_max'))
+    if args.get('name_prefix'):
+        conditions.append(_prefix(Actor.name, args['name_prefix']))
+    return conditions
@@ -1,98 +1,529 @@
 import os
-from sqlalchemy import Column, Date, Numeric, String, create_engine
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import (DDL, Column, Date, DateTime, ForeignKey, Index,
+                        Integer, LargeBinary, Numeric, String, and_,
+                        create_engine, delete, event, func, insert,
+                        literal_column, select, text, update)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+from sqlalchemy.exc import IntegrityError
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
 import json
 
-database_path = os.environ['DATABASE_URL']
-if database_path.startswith("postgres://"):
-    database_path = database_path.replace("postgres://", "postgresql://", 1)
+from database.cache import response_cache
+from database import routing
+from database.routing import RoutingSession
+from database.validation import ValidationError
+
+
+def sqlalchemy_url(url):
+    # Heroku and Render still hand out postgres:// URLs
+    if url and url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url
+
+
+database_path = sqlalchemy_url(os.environ['DATABASE_URL'])
+replica_path = sqlalchemy_url(routing.DATABASE_REPLICA_URL)
+
+# Connection pool of each engine; unset values keep SQLAlchemy's defaults.
+DB_POOL_SIZE = os.environ.get('DB_POOL_SIZE')
+DB_MAX_OVERFLOW = os.environ.get('DB_MAX_OVERFLOW')
+DB_POOL_TIMEOUT = os.environ.get('DB_POOL_TIMEOUT')
+# Seconds after which a connection is replaced (below the server's idle
+# timeout), and whether to test connections before handing them out.
+DB_POOL_RECYCLE = os.environ.get('DB_POOL_RECYCLE')
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '') in ('1', 'true')
+# Milliseconds a statement may run on Postgres before it is cancelled.
+DB_STATEMENT_TIMEOUT = os.environ.get('DB_STATEMENT_TIMEOUT')
+
+# Rows per multi-row INSERT statement of insert_many.
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+# Maintain the Rollup counts in every write (flask rebuild-rollups after
+# turning this on for an existing database).
+STATS_ROLLUPS = os.environ.get('STATS_ROLLUPS', '') in ('1', 'true')
+# Width of the actor age buckets of the statistics.
+AGE_BUCKET = int(os.environ.get('AGE_BUCKET', 10))
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate()
+
+# The search trigram indexes need pg_trgm and the Cast booking constraint
+# btree_gist when create_all builds the schema.
+event.listen(db.metadata, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS btree_gist')
+    .execute_if(dialect='postgresql'))
+
+# Bounds argument of daterange(): both ends of a booking are shooting days.
+INCLUSIVE = literal_column("'[]'")
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+'''
+write_listeners
+    Callables notified after every committed write through the models, as
+    listener(kind, event, rows): kind is 'movies' or 'actors', event is
+    'insert', 'update' or 'delete' and rows are dicts of the written column
+    values, always including 'id' (only 'id' for deletes).
+'''
+
+write_listeners = [response_cache.on_write]
+if replica_path:
+    write_listeners.append(routing.on_write)
+
+
+def notify_write(kind, event, rows):
+    for listener in write_listeners:
+        listener(kind, event, rows)
+
+
+'''
+Rollup buckets
+    The statistics dimensions of each kind, as functions from a row (a dict
+    of column values) to its bucket, stored as a string: '' stands for NULL.
+'''
+
+
+def year_bucket(row):
+    # release_date may still be the ISO string a client sent
+    value = row.get('release_date')
+    return str(value)[:4] if value else ''
+
+
+def age_bucket(row):
+    value = row.get('age')
+    if value is None:
+        return ''
+    try:
+        return str(int(Decimal(str(value)) // AGE_BUCKET * AGE_BUCKET))
+    except InvalidOperation:
+        return ''
+
+
+def gender_bucket(row):
+    return row.get('gender') or ''
+
+
+ROLLUPS = {
+    'movies': {'year': year_bucket},
+    'actors': {'age': age_bucket, 'gender': gender_bucket},
+}
+ROLLUP_COLUMNS = {'movies': ('release_date',), 'actors': ('age', 'gender')}
+
+
+def apply_rollups(kind, removed, added):
+    '''
+    Moves the rows removed and added by a write between the Rollup counts,
+    in the write's transaction. Does nothing unless STATS_ROLLUPS is set.
+    '''
+    if not STATS_ROLLUPS:
+        return
+    deltas = Counter()
+    for rows, sign in ((removed, -1), (added, 1)):
+        for row in rows:
+            for dimension, bucket in ROLLUPS[kind].items():
+                deltas[dimension, bucket(row)] += sign
+    Rollup.add(kind, {key: delta for key, delta in deltas.items() if delta})
+
+
+class ScheduleConflict(Exception):
+    '''
+    Raised when a booking would overlap another booking of the same actor;
+    conflicts lists the (actor_id, movie_id) bookings in the way, when known.
+    '''
+
+    def __init__(self, conflicts):
+        super().__init__('schedule conflict')
+        self.conflicts = conflicts
+
+
+class VersionConflict(Exception):
+    '''
+    Raised by update_by_id when the row has been updated since the version
+    the update was conditional on; version is the current one.
+    '''
+
+    def __init__(self, version):
+        super().__init__('version conflict')
+        self.version = version
+
+
+class BulkInsertError(Exception):
+    '''Raised by insert_many; ids lists the rows already committed.'''
+
+    def __init__(self, ids):
+        super().__init__(f'bulk insert failed after {len(ids)} rows')
+        self.ids = ids
+
+
+def insert_many(model, kind, rows, chunk_size=BULK_CHUNK_SIZE,
+                commit_chunks=False):
+    '''
+    Inserts rows (dicts of column values) with one multi-row INSERT ...
+    RETURNING per chunk_size rows and returns the new ids in input order.
+    Everything is committed in a single transaction unless commit_chunks
+    is set, in which case each chunk is committed as soon as it is written.
+    '''
+    ids = []
+    committed = []
+    statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+    try:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            ids.extend(db.session.scalars(statement, chunk).all())
+            apply_rollups(kind, [], chunk)
+            if commit_chunks:
+                db.session.commit()
+                committed = list(ids)
+        db.session.commit()
+        committed = ids
+    except Exception as e:
+        db.session.rollback()
+        raise BulkInsertError(committed) from e
+    finally:
+        if committed:
+            notify_write(kind, 'insert', [dict(row, id=id) for row, id
+                                          in zip(rows, committed)])
+    return ids
+
+
+def update_by_id(model, kind, id, values, then=None, versions=None):
+    '''
+    Applies values to one row with a single UPDATE ... RETURNING, which also
+    increments its version, and returns the updated row, or None if there is
+    no row with that id.
+    versions, if given, makes the update conditional (WHERE id = ? AND
+    version = ?, or IN for several): if the row is at another version,
+    nothing is written and VersionConflict is raised. No lock is taken, so
+    of concurrent updates from the same version exactly one succeeds.
+    then(row), if given, runs in the same transaction after the UPDATE and
+    returns further (kind, event, rows) writes to notify.
+    '''
+    match = model.id == id
+    if versions is not None:
+        match = and_(match, model.version == versions[0]
+                     if len(versions) == 1 else model.version.in_(versions))
+    statement = (update(model).where(match)
+                 .values(version=model.version + 1, **values)
+                 .returning(*model.__table__.columns)
+                 .execution_options(synchronize_session=False))
+    writes = []
+    rolled_up = STATS_ROLLUPS and set(values) & set(ROLLUP_COLUMNS[kind])
+    try:
+        old = None
+        if rolled_up:
+            old = db.session.execute(
+                select(*(getattr(model, column)
+                         for column in ROLLUP_COLUMNS[kind]))
+                .where(match).with_for_update()).one_or_none()
+        row = None
+        if old is not None or not rolled_up:
+            row = db.session.execute(statement).one_or_none()
+        if row is None and versions is not None:
+            current = db.session.scalar(
+                select(model.version).where(model.id == id))
+            if current is not None:
+                raise VersionConflict(current)
+        if row is not None and rolled_up:
+            apply_rollups(kind, [old._mapping], [row._mapping])
+        if row is not None and then is not None:
+            writes = then(row)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if row is not None:
+        notify_write(kind, 'update', [dict(row._mapping)])
+    for write in writes:
+        notify_write(*write)
+    return row
+
+
+def delete_by_id(model, kind, id, cast=None):
+    '''
+    Deletes one row with a single DELETE ... RETURNING id. Returns False if
+    there was no row with that id.
+    cast is (partner model, partner kind, Cast column of the partner, Cast
+    column of model): the partners cast with the row lose it from their
+    casts through ON DELETE CASCADE, so their updated_at is bumped first.
+    '''
+    statement = (delete(model).where(model.id == id)
+                 .returning(model.id, *(getattr(model, column)
+                                        for column in ROLLUP_COLUMNS[kind]))
+                 .execution_options(synchronize_session=False))
+    touched = []
+    try:
+        if cast is not None:
+            partner, partner_kind, partner_column, own_column = cast
+            touched = db.session.scalars(
+                update(partner)
+                .where(partner.id.in_(
+                    select(partner_column).where(own_column == id)))
+                .values(updated_at=utcnow())
+                .returning(partner.id)
+                .execution_options(synchronize_session=False)).all()
+        deleted = db.session.execute(statement).one_or_none()
+        if deleted is not None:
+            apply_rollups(kind, [deleted._mapping], [])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if deleted is None:
+        return False
+    notify_write(kind, 'delete', [{'id': id}])
+    if touched:
+        notify_write(partner_kind, 'update',
+                     [{'id': partner_id} for partner_id in touched])
+    return True
 
-db = SQLAlchemy()
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    The schema is managed by the alembic migrations in migrations/
+    (flask db upgrade); create_all=True builds it directly instead, for
+    throwaway databases such as SQLite in development.
+'''
+
+
+'''
+engine_options(url)
+    returns the create_engine options set through the DB_* variables for
+    the database at url (async drivers take the statement timeout as a
+    server setting)
 '''
 
 
-def setup_db(app, database_path=database_path):
+def engine_options(url):
+    options = {}
+    for option, value, kind in (('pool_size', DB_POOL_SIZE, int),
+                                ('max_overflow', DB_MAX_OVERFLOW, int),
+                                ('pool_timeout', DB_POOL_TIMEOUT, float),
+                                ('pool_recycle', DB_POOL_RECYCLE, int)):
+        if value is not None:
+            options[option] = kind(value)
+    if DB_POOL_PRE_PING:
+        options['pool_pre_ping'] = True
+    url = make_url(url)
+    if DB_STATEMENT_TIMEOUT and url.get_backend_name() == 'postgresql':
+        timeout = str(int(DB_STATEMENT_TIMEOUT))
+        if url.get_driver_name() == 'asyncpg':
+            options['connect_args'] = {
+                'server_settings': {'statement_timeout': timeout}}
+        else:
+            options['connect_args'] = {
+                'options': f'-c statement_timeout={timeout}'}
+    return options
+
+
+def setup_db(app, database_path=database_path, create_all=False):
     with app.app_context():
         app.config["SQLALCHEMY_DATABASE_URI"] = database_path
         app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+            database_path)
+        if replica_path:
+            # Holds no tables of its own: RoutingSession sends reads there
+            app.config["SQLALCHEMY_BINDS"] = {'replica': replica_path}
         db.app = app
         db.init_app(app)
-        db.create_all()
+        migrate.init_app(app, db)
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                # Cast relies on ON DELETE CASCADE
+                event.listen(engine, 'connect', enable_sqlite_foreign_keys)
+        if replica_path:
+            routing.init_app(app)
+        if create_all:
+            db.create_all()
+
+
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
 
 
 '''
 Movie
 That has the title and release date
+shooting_start and shooting_end are the optional shooting window (both days
+included), which books every actor cast in the movie
+updated_at is set on every insert and update and drives the ETag and
+Last-Modified headers of the movie endpoints
+version counts the updates of the row itself (not of its cast): PATCH is
+conditional on it, and every ORM flush of the row checks it too
 '''
 
 
 class Movie(db.Model):
     __tablename__ = 'Movie'
+    __table_args__ = (
+        Index('ix_Movie_release_date_id', 'release_date', 'id'),
+        Index('ix_Movie_title_id', 'title', 'id'),
+        Index('ix_Movie_updated_at', 'updated_at'),
+        # title_prefix filter (LIKE 'x%') under a non-C collation
+        Index('ix_Movie_title_pattern', 'title',
+              postgresql_ops={'title': 'text_pattern_ops'})
+        .ddl_if(dialect='postgresql'),
+        # GET /search
+        Index('ix_Movie_title_trgm', 'title', postgresql_using='gin',
+              postgresql_ops={'title': 'gin_trgm_ops'})
+        .ddl_if(dialect='postgresql'),
+    )
 
     id = Column(db.Integer, primary_key=True)
     title = Column(String)
     release_date = Column(Date)
+    shooting_start = Column(Date)
+    shooting_end = Column(Date)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    actors = db.relationship('Actor', secondary='Cast',
+                             back_populates='movies', order_by='Actor.id',
+                             passive_deletes=True)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, title, release_date):
         self.title = title
         self.release_date = release_date
 
+    @classmethod
+    def insert_many(cls, rows, **kwargs):
+        return insert_many(cls, 'movies', rows, **kwargs)
+
+    @classmethod
+    def update_by_id(cls, id, values, versions=None):
+        # the cast embeds the movie, rescheduled or not
+        if 'shooting_start' in values or 'shooting_end' in values:
+            return update_by_id(cls, 'movies', id, values,
+                                then=Cast.reschedule, versions=versions)
+        return update_by_id(cls, 'movies', id, values,
+                            then=Cast.touch_actors, versions=versions)
+
+    @classmethod
+    def delete_by_id(cls, id):
+        return delete_by_id(cls, 'movies', id,
+                            cast=(Actor, 'actors', Cast.actor_id,
+                                  Cast.movie_id))
+
     def insert(self):
         db.session.add(self)
+        apply_rollups('movies', [], [self.format()])
         db.session.commit()
+        notify_write('movies', 'insert', [self.format()])
 
     def update(self, title, release_date):
+        old = self.format()
         self.title = title
         self.release_date = release_date
+        apply_rollups('movies', [old], [self.format()])
         db.session.commit()
+        notify_write('movies', 'update', [self.format()])
 
     def delete(self):
+        id = self.id
+        apply_rollups('movies', [self.format()], [])
         db.session.delete(self)
         db.session.commit()
+        notify_write('movies', 'delete', [{'id': id}])
 
     def format(self):
         return {
             'id': self.id,
             'title': self.title,
-            'release_date': self.release_date}
+            'release_date': self.release_date,
+            'shooting_start': self.shooting_start,
+            'shooting_end': self.shooting_end}
 
 
 '''
 Actor
 That has the name, age and gender
+updated_at is set on every insert and update, and version on every update,
+as for Movie
 '''
 
 
 class Actor(db.Model):
     __tablename__ = 'Actor'
+    __table_args__ = (
+        Index('ix_Actor_name_id', 'name', 'id'),
+        Index('ix_Actor_age_id', 'age', 'id'),
+        Index('ix_Actor_gender_age', 'gender', 'age'),
+        Index('ix_Actor_updated_at', 'updated_at'),
+        Index('ix_Actor_name_pattern', 'name',
+              postgresql_ops={'name': 'text_pattern_ops'})
+        .ddl_if(dialect='postgresql'),
+        Index('ix_Actor_name_trgm', 'name', postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'})
+        .ddl_if(dialect='postgresql'),
+    )
 
     id = Column(db.Integer, primary_key=True)
     name = Column(String)
     age = Column(Numeric)
     gender = Column(String)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    movies = db.relationship('Movie', secondary='Cast',
+                             back_populates='actors', order_by='Movie.id',
+                             passive_deletes=True)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, name, age, gender):
         self.name = name
         self.age = age
         self.gender = gender
 
+    @classmethod
+    def insert_many(cls, rows, **kwargs):
+        return insert_many(cls, 'actors', rows, **kwargs)
+
+    @classmethod
+    def update_by_id(cls, id, values, versions=None):
+        return update_by_id(cls, 'actors', id, values,
+                            then=Cast.touch_movies, versions=versions)
+
+    @classmethod
+    def delete_by_id(cls, id):
+        return delete_by_id(cls, 'actors', id,
+                            cast=(Movie, 'movies', Cast.movie_id,
+                                  Cast.actor_id))
+
     def insert(self):
         db.session.add(self)
+        apply_rollups('actors', [], [self.format()])
         db.session.commit()
+        notify_write('actors', 'insert', [self.format()])
 
     def update(self, name, age, gender):
+        old = self.format()
         self.name = name
         self.age = age
         self.gender = gender
+        apply_rollups('actors', [old], [self.format()])
         db.session.commit()
+        notify_write('actors', 'update', [self.format()])
 
     def delete(self):
+        id = self.id
+        apply_rollups('actors', [self.format()], [])
         db.session.delete(self)
         db.session.commit()
+        notify_write('actors', 'delete', [{'id': id}])
 
     def format(self):
         return {
@@ -100,3 +531,309 @@ class Actor(db.Model):
             'name': self.name,
             'age': self.age,
             'gender': self.gender}
+
+
+'''
+Cast
+Which actors are cast in which movie
+Assigning or removing an actor bumps updated_at of both the movie and the
+actor, since their ?include= representations change
+starts and ends book the actor for the movie's shooting window (NULL while
+the movie has none). An actor's bookings may not overlap: on Postgres a
+GiST exclusion constraint over (actor_id, daterange(starts, ends)) enforces
+it and indexes the overlap queries.
+'''
+
+
+class Cast(db.Model):
+    __tablename__ = 'Cast'
+    __table_args__ = (
+        Index('ix_Cast_actor_id', 'actor_id'),
+        ExcludeConstraint(
+            ('actor_id', '='),
+            (func.daterange(text('starts'), text('ends'), INCLUSIVE), '&&'),
+            name='ex_Cast_actor_booking', using='gist',
+            where=text('starts IS NOT NULL'))
+        .ddl_if(dialect='postgresql'),
+    )
+
+    movie_id = Column(Integer, ForeignKey('Movie.id', ondelete='CASCADE'),
+                      primary_key=True)
+    actor_id = Column(Integer, ForeignKey('Actor.id', ondelete='CASCADE'),
+                      primary_key=True)
+    starts = Column(Date)
+    ends = Column(Date)
+
+    @classmethod
+    def overlapping(cls, starts, ends):
+        '''
+        Condition matching the bookings that share a day with the window
+        starts..ends, written on Postgres so that it uses the exclusion
+        constraint's GiST index.
+        '''
+        if db.engine.dialect.name == 'postgresql':
+            return and_(
+                cls.starts.is_not(None),
+                func.daterange(cls.starts, cls.ends, INCLUSIVE).op('&&')(
+                    func.daterange(starts, ends, INCLUSIVE)))
+        return and_(cls.starts <= ends, cls.ends >= starts)
+
+    @classmethod
+    def conflicts(cls, actor_ids, starts, ends, movie_id):
+        '''
+        The (actor_id, movie_id) bookings of actor_ids (a list or a select)
+        in other movies than movie_id overlapping starts..ends.
+        '''
+        return [tuple(row) for row in db.session.execute(
+            select(cls.actor_id, cls.movie_id)
+            .where(cls.actor_id.in_(actor_ids), cls.movie_id != movie_id,
+                   cls.overlapping(starts, ends))
+            .order_by(cls.actor_id, cls.movie_id))]
+
+    @staticmethod
+    def _flush_bookings(statement):
+        '''
+        Executes a write of bookings, turning a violation of the Postgres
+        exclusion constraint by a concurrent booking into ScheduleConflict.
+        '''
+        try:
+            return db.session.execute(statement)
+        except IntegrityError as e:
+            if getattr(e.orig, 'pgcode', None) == '23P01':
+                raise ScheduleConflict([]) from e
+            raise
+
+    @classmethod
+    def reschedule(cls, movie):
+        '''
+        Moves the bookings of movie's cast to its new shooting window, for
+        Movie.update_by_id. Raises ScheduleConflict if any of them overlaps
+        another booking of the actor, or ValidationError for a window ending
+        before it starts.
+        '''
+        starts, ends = movie.shooting_start, movie.shooting_end
+        if starts is None or ends is None:
+            starts = ends = None
+        elif starts > ends:
+            raise ValidationError('shooting_end is before shooting_start')
+        cast = select(cls.actor_id).where(cls.movie_id == movie.id)
+        if starts is not None:
+            conflicts = cls.conflicts(cast, starts, ends, movie.id)
+            if conflicts:
+                raise ScheduleConflict(conflicts)
+        cls._flush_bookings(
+            update(cls).where(cls.movie_id == movie.id)
+            .values(starts=starts, ends=ends)
+            .execution_options(synchronize_session=False))
+        return cls.touch_actors(movie)
+
+    @classmethod
+    def touch_actors(cls, movie):
+        '''
+        Bumps the updated_at of movie's cast to movie's, for
+        Movie.update_by_id: they embed it (?include=movies), so their ETags
+        and cached responses change with it.
+        '''
+        return cls._touch_cast(Actor, 'actors', cls.actor_id, cls.movie_id,
+                               movie)
+
+    @classmethod
+    def touch_movies(cls, actor):
+        '''touch_actors for Actor.update_by_id.'''
+        return cls._touch_cast(Movie, 'movies', cls.movie_id, cls.actor_id,
+                               actor)
+
+    @staticmethod
+    def _touch_cast(partner, kind, partner_key, own_key, row):
+        cast = select(partner_key).where(own_key == row.id)
+        ids = db.session.execute(
+            update(partner).where(partner.id.in_(cast))
+            .values(updated_at=row.updated_at).returning(partner.id)
+            .execution_options(synchronize_session=False)).scalars().all()
+        if not ids:
+            return []
+        return [(kind, 'update', [{'id': id} for id in ids])]
+
+    @staticmethod
+    def _touch(movie_id, actor_id):
+        now = utcnow()
+        db.session.execute(update(Movie).where(Movie.id == movie_id)
+                           .values(updated_at=now)
+                           .execution_options(synchronize_session=False))
+        db.session.execute(update(Actor).where(Actor.id == actor_id)
+                           .values(updated_at=now)
+                           .execution_options(synchronize_session=False))
+
+    @staticmethod
+    def _notify(movie_id, actor_id):
+        notify_write('movies', 'update', [{'id': movie_id}])
+        notify_write('actors', 'update', [{'id': actor_id}])
+
+    @classmethod
+    def assign(cls, movie_id, actor_id):
+        '''
+        Casts the actor in the movie, booking them for its shooting window.
+        Returns False if either does not exist; assigning twice is a no-op.
+        Raises ScheduleConflict if the actor is booked elsewhere during the
+        shoot.
+        '''
+        window = db.session.execute(
+            select(Movie.shooting_start, Movie.shooting_end,
+                   select(Actor.id).where(Actor.id == actor_id).exists())
+            .where(Movie.id == movie_id)).one_or_none()
+        if window is None or not window[2]:
+            return False
+        if db.session.get(cls, (movie_id, actor_id)) is not None:
+            return True
+        starts, ends, _ = window
+        if starts is None or ends is None:
+            starts = ends = None
+        try:
+            if starts is not None:
+                conflicts = cls.conflicts([actor_id], starts, ends, movie_id)
+                if conflicts:
+                    raise ScheduleConflict(conflicts)
+            cls._flush_bookings(insert(cls).values(
+                movie_id=movie_id, actor_id=actor_id, starts=starts,
+                ends=ends))
+            cls._touch(movie_id, actor_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cls._notify(movie_id, actor_id)
+        return True
+
+    @classmethod
+    def unassign(cls, movie_id, actor_id):
+        '''
+        Removes the actor from the movie's cast. Returns False if the actor
+        was not cast in it.
+        '''
+        statement = (delete(cls).where(cls.movie_id == movie_id,
+                                       cls.actor_id == actor_id)
+                     .execution_options(synchronize_session=False))
+        try:
+            deleted = db.session.execute(statement).rowcount
+            if deleted:
+                cls._touch(movie_id, actor_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if not deleted:
+            return False
+        cls._notify(movie_id, actor_id)
+        return True
+
+
+'''
+Rollup
+Row counts of each kind per statistics bucket (see ROLLUPS), maintained in
+the write paths when STATS_ROLLUPS is set so that GET /stats reads a few
+rows by primary key instead of aggregating the table
+'''
+
+
+class Rollup(db.Model):
+    __tablename__ = 'Rollup'
+
+    kind = Column(String, primary_key=True)
+    dimension = Column(String, primary_key=True)
+    value = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def add(cls, kind, deltas):
+        '''
+        Adds deltas, a dict from (dimension, value) to a count change, with
+        one INSERT ... ON CONFLICT DO UPDATE. Rows are written in key order
+        so that concurrent writers lock them in the same order.
+        '''
+        if not deltas:
+            return
+        dialect_insert = (postgresql.insert
+                          if db.engine.dialect.name == 'postgresql'
+                          else sqlite.insert)
+        statement = dialect_insert(cls).values([
+            {'kind': kind, 'dimension': dimension, 'value': value,
+             'count': delta}
+            for (dimension, value), delta in sorted(deltas.items())])
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['kind', 'dimension', 'value'],
+            set_={'count': cls.count + statement.excluded.count}))
+
+
+'''
+IdempotencyKey
+The outcome of a create request sent with an Idempotency-Key header, per
+client and key: the fingerprint of the request, and its status and body once
+it has completed (both NULL while it runs). The primary key makes claiming a
+key one INSERT that only one of concurrent requests wins, and every lookup
+one index probe
+'''
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'IdempotencyKey'
+    __table_args__ = (
+        Index('ix_IdempotencyKey_created_at', 'created_at'),
+    )
+
+    client = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    status = Column(Integer)
+    body = Column(LargeBinary)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+
+    @classmethod
+    def claim(cls, client, key, fingerprint):
+        '''
+        Inserts the key unless it exists, committed at once so that
+        concurrent requests see it. True if this call inserted it.
+        '''
+        dialect_insert = (postgresql.insert
+                          if db.engine.dialect.name == 'postgresql'
+                          else sqlite.insert)
+        result = db.session.execute(
+            dialect_insert(cls).values(client=client, key=key,
+                                       fingerprint=fingerprint,
+                                       created_at=utcnow())
+            .on_conflict_do_nothing(index_elements=['client', 'key']))
+        db.session.commit()
+        return result.rowcount == 1
+
+    @classmethod
+    def lookup(cls, client, key):
+        return db.session.execute(
+            select(cls.fingerprint, cls.status, cls.body, cls.created_at)
+            .where(cls.client == client, cls.key == key)).one_or_none()
+
+    @classmethod
+    def complete(cls, client, key, status, body):
+        db.session.execute(update(cls)
+                           .where(cls.client == client, cls.key == key)
+                           .values(status=status, body=body))
+        db.session.commit()
+
+    @classmethod
+    def release(cls, client, key, created_at=None):
+        '''
+        Deletes the key, only if it still has created_at when given (so
+        that of two requests taking over an expired key, one does).
+        '''
+        statement = delete(cls).where(cls.client == client, cls.key == key)
+        if created_at is not None:
+            statement = statement.where(cls.created_at == created_at)
+        deleted = db.session.execute(statement).rowcount
+        db.session.commit()
+        return deleted == 1
+
+    @classmethod
+    def purge(cls, before):
+        '''Deletes the keys created before the datetime before.'''
+        deleted = db.session.execute(
+            delete(cls).where(cls.created_at < before)).rowcount
+        db.session.commit()
+        return deleted
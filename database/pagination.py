@@ -0,0 +1,148 @@
+import base64
+import datetime
+import decimal
+import json
+import os
+
+from sqlalchemy import and_, or_
+
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+
+
+class InvalidPageRequest(ValueError):
+    pass
+
+
+'''
+Cursors
+    An opaque, URL-safe token holding the sort field and the (sort value, id)
+    of the last row of the previous page.
+'''
+
+
+def _dump_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+def _load_value(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime.date:
+        return datetime.date.fromisoformat(value)
+    if python_type is datetime.datetime:
+        return datetime.datetime.fromisoformat(value)
+    return python_type(value)
+
+
+def encode_cursor(sort, value, id):
+    raw = json.dumps([sort, _dump_value(value), id]).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor, sort, column):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, id = json.loads(base64.urlsafe_b64decode(padded))
+        if cursor_sort != sort:
+            raise InvalidPageRequest('cursor does not match sort')
+        return _load_value(column, value), int(id)
+    except InvalidPageRequest:
+        raise
+    except Exception:
+        raise InvalidPageRequest('invalid cursor')
+
+
+def page_limit(raw):
+    if raw is None:
+        return PAGE_SIZE
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise InvalidPageRequest('limit must be an integer')
+    if limit < 1:
+        raise InvalidPageRequest('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_sort(sort):
+    '''
+    Splits a sort parameter into (field, descending): "release_date" sorts
+    ascending and "-release_date" descending.
+    '''
+    if sort.startswith('-'):
+        return sort[1:], True
+    return sort, False
+
+
+'''
+keyset_page(statement, model, sort, after, limit)
+    orders statement by (sort, id) and restricts it to the rows after the
+    cursor, so each page is an index range scan on (sort, id) instead of an
+    OFFSET. NULL sort values come last, and a descending sort is the exact
+    reverse (NULLs first) so it is a backward scan of the same index.
+    One extra row is fetched to tell whether there is a next page.
+'''
+
+
+def keyset_page(statement, model, sort, after, limit):
+    field, descending = parse_sort(sort)
+    column = getattr(model, field)
+    value = last_id = None
+    if after is not None:
+        value, last_id = decode_cursor(after, sort, column)
+
+    if field == 'id':
+        if descending:
+            statement = statement.order_by(model.id.desc())
+            if after is not None:
+                statement = statement.where(model.id < last_id)
+        else:
+            statement = statement.order_by(model.id)
+            if after is not None:
+                statement = statement.where(model.id > last_id)
+        return statement.limit(limit + 1)
+
+    if descending:
+        statement = statement.order_by(column.desc().nulls_first(),
+                                       model.id.desc())
+        if after is not None:
+            if value is None:
+                statement = statement.where(or_(
+                    and_(column.is_(None), model.id < last_id),
+                    column.is_not(None)))
+            else:
+                statement = statement.where(or_(
+                    column < value,
+                    and_(column == value, model.id < last_id)))
+        return statement.limit(limit + 1)
+
+    statement = statement.order_by(column.asc().nulls_last(), model.id)
+    if after is not None:
+        if value is None:
+            statement = statement.where(
+                and_(column.is_(None), model.id > last_id))
+        else:
+            statement = statement.where(or_(
+                column > value,
+                and_(column == value, model.id > last_id),
+                column.is_(None)))
+    return statement.limit(limit + 1)
+
+
+def next_cursor(rows, sort, limit):
+    '''
+    Trims the extra row fetched by keyset_page and returns (rows, cursor),
+    where cursor is None on the last page.
+    '''
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    field, _ = parse_sort(sort)
+    return rows, encode_cursor(sort, getattr(last, field), last.id)
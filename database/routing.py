@@ -0,0 +1,100 @@
+import hashlib
+import os
+
+from flask import g, request
+from flask_sqlalchemy.session import Session
+from jose import jwt
+from sqlalchemy import Select
+
+from database.cache import CACHE_BACKEND, CACHE_URL, LRUBackend, RedisBackend
+
+# Optional read replica for the GET endpoints.
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+# Seconds after a client's own write during which its reads stay on the
+# primary, so they see the write whatever the replication lag.
+READ_YOUR_WRITES = float(os.environ.get('READ_YOUR_WRITES', 5))
+
+READ_METHODS = ('GET', 'HEAD')
+
+# Recent writers, shared between workers when the cache is on Redis.
+recent_writes = (RedisBackend.from_url(CACHE_URL) if CACHE_BACKEND == 'redis'
+                 else LRUBackend())
+
+
+def client_key(headers):
+    '''
+    Identifies the client of a request by the subject of its bearer token.
+    The token is only decoded, not verified: a forged subject can do no
+    more than send its own reads to the primary.
+    '''
+    token = headers.get('Authorization', '').partition(' ')[2]
+    if not token:
+        return None
+    try:
+        subject = jwt.get_unverified_claims(token).get('sub')
+    except Exception:
+        subject = None
+    if subject is None:
+        subject = hashlib.sha256(token.encode()).hexdigest()
+    return f'write:{subject}'
+
+
+def record_write(key):
+    if key is not None:
+        recent_writes.set(key, b'1', READ_YOUR_WRITES)
+
+
+def wrote_recently(key):
+    return key is not None and recent_writes.get(key) is not None
+
+
+def on_write(kind, event, rows):
+    '''
+    Write listener (see database.models.notify_write), registered when
+    reads go to a replica: the replica may not show writes of kind for
+    READ_YOUR_WRITES seconds.
+    '''
+    recent_writes.set(f'kind:{kind}', b'1', READ_YOUR_WRITES)
+
+
+def replica_lagging(kind):
+    return recent_writes.get(f'kind:{kind}') is not None
+
+
+'''
+RoutingSession
+    db.session class sending the SELECTs of requests flagged by route_reads
+    to the 'replica' bind. Flushes and every other statement (UPDATE ...
+    RETURNING, DELETE, SELECT ... FOR UPDATE inside writes) use the primary.
+'''
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing
+                and isinstance(clause, Select)
+                and clause._for_update_arg is None
+                and g and g.get('read_replica')):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+def route_reads():
+    g.read_replica = (request.method in READ_METHODS and
+                      not wrote_recently(client_key(request.headers)))
+
+
+def remember_writes(response):
+    if request.method not in READ_METHODS and response.status_code < 400:
+        record_write(client_key(request.headers))
+    return response
+
+
+def init_app(app):
+    '''
+    Routes the reads of app to the replica and records its clients' writes.
+    Only used when DATABASE_REPLICA_URL is set.
+    '''
+    app.before_request(route_reads)
+    app.after_request(remember_writes)
@@ -0,0 +1,260 @@
+import random
+import threading
+
+from sqlalchemy import bindparam, exists, select
+
+from database.models import Actor, Cast, db, write_listeners
+
+
+'''
+IntervalTree
+    Treap of (starts, ends, actor_id, movie_id) bookings ordered by start,
+    where every node also keeps the latest end in its subtree. Inserts and
+    removals are O(log n) expected, and overlapping(starts, ends) skips every
+    subtree that ends before the window or starts after it, so it costs
+    O(log n + k) for k results.
+'''
+
+
+class _Node:
+    __slots__ = ('key', 'priority', 'left', 'right', 'max_end')
+
+    def __init__(self, key):
+        self.key = key
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.max_end = key[1]
+
+
+def _update(node):
+    max_end = node.key[1]
+    if node.left is not None and node.left.max_end > max_end:
+        max_end = node.left.max_end
+    if node.right is not None and node.right.max_end > max_end:
+        max_end = node.right.max_end
+    node.max_end = max_end
+
+
+def _split(node, key, inclusive):
+    '''
+    Splits node into the keys before key (and key itself when inclusive) and
+    the rest.
+    '''
+    if node is None:
+        return None, None
+    if node.key < key or (inclusive and node.key == key):
+        node.right, right = _split(node.right, key, inclusive)
+        _update(node)
+        return node, right
+    left, node.left = _split(node.left, key, inclusive)
+    _update(node)
+    return left, node
+
+
+def _merge(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+class IntervalTree:
+    def __init__(self, keys=()):
+        self._root = None
+        self._size = 0
+        self.build(keys)
+
+    def __len__(self):
+        return self._size
+
+    def build(self, keys):
+        '''
+        Replaces the contents with keys in O(n log n), building the treap of
+        the sorted keys in one pass instead of n inserts.
+        '''
+        keys = sorted(keys)
+        stack = []
+        for key in keys:
+            node = _Node(key)
+            last = None
+            while stack and stack[-1].priority < node.priority:
+                last = stack.pop()
+                _update(last)
+            node.left = last
+            if stack:
+                stack[-1].right = node
+            stack.append(node)
+        while len(stack) > 1:
+            _update(stack.pop())
+        if stack:
+            _update(stack[0])
+        self._root = stack[0] if stack else None
+        self._size = len(keys)
+
+    def add(self, key):
+        left, right = _split(self._root, key, False)
+        node = right
+        while node is not None and node.left is not None:
+            node = node.left
+        if node is not None and node.key == key:
+            self._root = _merge(left, right)
+            return
+        self._root = _merge(_merge(left, _Node(key)), right)
+        self._size += 1
+
+    def remove(self, key):
+        left, right = _split(self._root, key, False)
+        middle, right = _split(right, key, True)
+        if middle is not None:
+            self._size -= 1
+        self._root = _merge(left, right)
+
+    def overlapping(self, starts, ends):
+        '''
+        Yields the keys sharing a day with starts..ends in start order;
+        None leaves that side of the window open.
+        '''
+        stack = []
+        node = self._root
+        while stack or node is not None:
+            while node is not None:
+                if starts is not None and node.max_end < starts:
+                    node = None
+                    break
+                stack.append(node)
+                node = node.left
+            if not stack:
+                break
+            node = stack.pop()
+            if ends is not None and node.key[0] > ends:
+                break
+            if starts is None or node.key[1] >= starts:
+                yield node.key
+            node = node.right
+
+
+'''
+ScheduleIndex
+    The bookings held in an IntervalTree for databases without range types,
+    kept up to date from write_listeners: a movie update reloads its
+    bookings, a movie or actor delete drops theirs.
+'''
+
+
+class ScheduleIndex:
+    def __init__(self):
+        self.built = False
+        self._tree = IntervalTree()
+        self._by_movie = {}
+        self._by_actor = {}
+        self._lock = threading.Lock()
+
+    def _add(self, key):
+        self._tree.add(key)
+        self._by_movie.setdefault(key[3], set()).add(key)
+        self._by_actor.setdefault(key[2], set()).add(key)
+
+    def _discard(self, key):
+        self._tree.remove(key)
+        for by, id in ((self._by_movie, key[3]), (self._by_actor, key[2])):
+            keys = by[id]
+            keys.discard(key)
+            if not keys:
+                del by[id]
+
+    def build(self, keys):
+        with self._lock:
+            keys = list(keys)
+            self._tree.build(keys)
+            self._by_movie = {}
+            self._by_actor = {}
+            for key in keys:
+                self._by_movie.setdefault(key[3], set()).add(key)
+                self._by_actor.setdefault(key[2], set()).add(key)
+            self.built = True
+
+    def set_movie(self, movie_id, keys):
+        with self._lock:
+            if not self.built:
+                return
+            for key in list(self._by_movie.get(movie_id, ())):
+                self._discard(key)
+            for key in keys:
+                self._add(key)
+
+    def remove_movie(self, movie_id):
+        with self._lock:
+            for key in list(self._by_movie.get(movie_id, ())):
+                self._discard(key)
+
+    def remove_actor(self, actor_id):
+        with self._lock:
+            for key in list(self._by_actor.get(actor_id, ())):
+                self._discard(key)
+
+    def busy_actors(self, starts, ends):
+        with self._lock:
+            return {key[2] for key in self._tree.overlapping(starts, ends)}
+
+
+schedule_index = ScheduleIndex()
+_build_lock = threading.Lock()
+
+
+def _bookings(*conditions):
+    return db.session.execute(
+        select(Cast.starts, Cast.ends, Cast.actor_id, Cast.movie_id)
+        .where(Cast.starts.is_not(None), *conditions)
+        .execution_options(yield_per=10000))
+
+
+def update_schedule(kind, event, rows):
+    '''Write listener keeping schedule_index up to date.'''
+    # while it is being built, set_movie waits for it and then reloads
+    if not (schedule_index.built or _build_lock.locked()):
+        return
+    for row in rows:
+        if kind == 'movies' and event == 'update':
+            schedule_index.set_movie(row['id'], [
+                tuple(key) for key in _bookings(Cast.movie_id == row['id'])])
+        elif kind == 'movies' and event == 'delete':
+            schedule_index.remove_movie(row['id'])
+        elif kind == 'actors' and event == 'delete':
+            schedule_index.remove_actor(row['id'])
+
+
+write_listeners.append(update_schedule)
+
+
+def _index():
+    if not schedule_index.built:
+        with _build_lock:
+            if not schedule_index.built:
+                schedule_index.build(tuple(key) for key in _bookings())
+    return schedule_index
+
+
+def available(starts, ends):
+    '''
+    Condition on Actor matching the actors with no booking sharing a day with
+    starts..ends. Postgres probes the GiST index of the Cast exclusion
+    constraint; other databases exclude the busy actors found in the
+    in-process IntervalTree.
+    '''
+    if db.engine.dialect.name == 'postgresql':
+        return ~exists().where(Cast.actor_id == Actor.id,
+                               Cast.overlapping(starts, ends))
+
+    busy = sorted(_index().busy_actors(starts, ends))
+    # inlined rather than bound, as there may be more busy actors than
+    # the database allows parameters
+    return Actor.id.not_in(bindparam('busy_actors', busy, expanding=True,
+                                     literal_execute=True))
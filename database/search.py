@@ -0,0 +1,211 @@
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from sqlalchemy import func, or_, select
+
+from database.models import Actor, Movie, db, write_listeners
+
+# Minimum share of the query's trigrams a match must contain.
+SEARCH_THRESHOLD = float(os.environ.get('SEARCH_THRESHOLD', 0.5))
+SEARCH_LIMIT = int(os.environ.get('SEARCH_LIMIT', 10))
+MAX_SEARCH_LIMIT = 50
+
+WORD = re.compile(r'\w+')
+
+
+def trigrams(text, prefix=False):
+    '''
+    The set of trigrams of each word of text, padded like pg_trgm (two
+    spaces before and one after the word). With prefix=True the last word is
+    left open at the end, so "jo" matches "john".
+    '''
+    words = WORD.findall(text.lower())
+    grams = set()
+    for i, word in enumerate(words):
+        padded = '  ' + word
+        if not (prefix and i == len(words) - 1):
+            padded += ' '
+        grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return grams
+
+
+'''
+NgramIndex
+    In-process inverted index from trigrams to document ids, for databases
+    without pg_trgm. A query matches the documents containing at least
+    SEARCH_THRESHOLD of its trigrams (all of them for one- or two-trigram
+    queries), which tolerates typos. Matches are ranked by the mean of that
+    share and their trigram similarity, so closer, shorter texts come first.
+    Candidates are only collected from the rarest trigrams a match must
+    contain and checked against the other posting sets by lookup.
+'''
+
+
+class NgramIndex:
+    def __init__(self):
+        self.built = False
+        self._postings = {}
+        self._grams = {}
+        self._lock = threading.Lock()
+        self._building = False
+        self._removed = None
+
+    def _add(self, id, text):
+        self._remove(id)
+        grams = trigrams(text or '')
+        self._grams[id] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(id)
+
+    def _remove(self, id):
+        for gram in self._grams.pop(id, ()):
+            posting = self._postings[gram]
+            posting.discard(id)
+            if not posting:
+                del self._postings[gram]
+
+    def add(self, id, text):
+        with self._lock:
+            if self.built or self._building:
+                self._add(id, text)
+
+    def remove(self, id):
+        with self._lock:
+            if self._building:
+                self._removed.add(id)
+            if self.built or self._building:
+                self._remove(id)
+
+    def build(self, rows):
+        '''
+        Loads (id, text) rows. Writes notified while building win over the
+        rows being read, which may predate them.
+        '''
+        with self._lock:
+            self._building = True
+            self._removed = set()
+        for id, text in rows:
+            with self._lock:
+                if id not in self._grams and id not in self._removed:
+                    self._add(id, text)
+        with self._lock:
+            self.built = True
+            self._building = False
+            self._removed = None
+
+    def search(self, query, limit):
+        '''Returns up to limit (id, score) pairs, best first.'''
+        query_grams = trigrams(query, prefix=True)
+        if not query_grams:
+            return []
+        needed = len(query_grams)
+        if needed > 2:
+            needed = math.ceil(needed * SEARCH_THRESHOLD)
+
+        with self._lock:
+            postings = sorted((self._postings.get(gram, ())
+                               for gram in query_grams), key=len)
+            # A document sharing `needed` trigrams with the query holds at
+            # least one of the len(postings) - needed + 1 rarest, so only
+            # those are scanned for candidates; the commoner ones are only
+            # probed for candidates that can still reach `needed`.
+            split = len(postings) - needed + 1
+            counts = Counter()
+            for posting in postings[:split]:
+                counts.update(posting)
+            common = postings[split:]
+            matches = []
+            for id, shared in counts.items():
+                if shared + len(common) < needed:
+                    continue
+                for posting in common:
+                    if id in posting:
+                        shared += 1
+                if shared < needed:
+                    continue
+                similarity = shared / (len(query_grams) +
+                                       len(self._grams[id]) - shared)
+                matches.append(((shared / len(query_grams) + similarity) / 2,
+                                -id))
+
+        return [(-negative_id, round(score, 4)) for score, negative_id
+                in heapq.nlargest(limit, matches)]
+
+
+'''
+Search targets
+    The searchable text column of each kind, and the in-process index used
+    for it when the database is not Postgres.
+'''
+
+TARGETS = {
+    'movies': (Movie, Movie.title),
+    'actors': (Actor, Actor.name),
+}
+indexes = {kind: NgramIndex() for kind in TARGETS}
+_build_lock = threading.Lock()
+
+
+def update_indexes(kind, event, rows):
+    '''Write listener keeping the in-process indexes up to date.'''
+    index = indexes[kind]
+    column = TARGETS[kind][1].key
+    for row in rows:
+        if event == 'delete':
+            index.remove(row['id'])
+        elif column in row:
+            index.add(row['id'], row[column])
+
+
+write_listeners.append(update_indexes)
+
+
+def _index(kind):
+    index = indexes[kind]
+    if not index.built:
+        with _build_lock:
+            if not index.built:
+                model, column = TARGETS[kind]
+                result = db.session.execute(
+                    select(model.id, column).execution_options(
+                        yield_per=10000))
+                index.build(result)
+    return index
+
+
+def _escape_like(text):
+    return (text.replace('\\', '\\\\').replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+def search(kind, query, limit):
+    '''
+    Returns up to limit (row, score) pairs of kind matching query, best
+    first, where row is a model instance.
+    Postgres uses the pg_trgm GIN indexes (substring match or trigram
+    similarity above pg_trgm.similarity_threshold); other databases use
+    the in-process NgramIndex.
+    '''
+    model, column = TARGETS[kind]
+    if db.engine.dialect.name == 'postgresql':
+        score = func.similarity(column, query)
+        statement = (
+            select(model, score)
+            .where(or_(column.ilike(f'%{_escape_like(query)}%', escape='\\'),
+                       column.op('%')(query)))
+            .order_by(score.desc(), model.id)
+            .limit(limit))
+        return [(row, round(float(rank), 4))
+                for row, rank in db.session.execute(statement)]
+
+    ranked = _index(kind).search(query, limit)
+    if not ranked:
+        return []
+    rows = {row.id: row for row in db.session.execute(
+        select(model).where(model.id.in_([id for id, _ in ranked])))
+        .scalars()}
+    return [(rows[id], score) for id, score in ranked if id in rows]
@@ -0,0 +1,163 @@
+import json
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from operator import attrgetter
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import select
+
+from database.models import Actor, Cast, Movie
+
+try:
+    import orjson
+except ImportError:  # optional: pip install orjson
+    orjson = None
+
+
+def default(value):
+    '''
+    Encodes the column types JSON has no type for: Decimals as numbers
+    (NaN and Infinity, which JSON cannot hold, as null), dates and
+    datetimes as ISO 8601 strings.
+    '''
+    if isinstance(value, Decimal):
+        if not value.is_finite():
+            return None
+        if value == value.to_integral_value():
+            return int(value)
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+_encoder = json.JSONEncoder(default=default, ensure_ascii=False,
+                            separators=(',', ':'))
+
+
+def dumps(obj):
+    '''
+    obj as compact UTF-8 JSON bytes, encoded by orjson when it is
+    installed.
+    '''
+    if orjson is not None:
+        return orjson.dumps(obj, default=default)
+    return _encoder.encode(obj).encode()
+
+
+'''
+JSONProvider
+    Flask's JSON provider, encoding through dumps: jsonify hands the bytes
+    straight to the response.
+'''
+
+
+class JSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode()
+
+    def response(self, *args, **kwargs):
+        return self._app.response_class(
+            dumps(self._prepare_response_obj(args, kwargs)),
+            mimetype=self.mimetype)
+
+
+'''
+Schema
+    The JSON representation of one model: the listed columns, under their
+    own names. dump() reads ORM instances and the Rows of
+    select(*schema.columns) alike, so list reads never build instances;
+    values are kept as they are for the encoder.
+    Embedded relationships are loaded for a whole page at once, with one
+    query each (related_query) whose rows dump_all groups by owner.
+    only() narrows a schema to a sparse fieldset.
+'''
+
+
+class Schema:
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.columns = tuple(getattr(model, field) for field in fields)
+        self._values = attrgetter(*fields)
+        if len(fields) == 1:
+            # attrgetter returns the value itself rather than a 1-tuple
+            value = self._values
+            self._values = lambda row: (value(row),)
+        self._embeds = {}
+        self._subsets = {}
+
+    def embed(self, name, schema, owner_key, target_key):
+        '''
+        Declares name as a relationship to the rows of schema, linked by
+        the owner_key and target_key columns of an association table.
+        '''
+        self._embeds[name] = (schema, owner_key, target_key)
+
+    def only(self, fields):
+        '''
+        The schema restricted to fields, kept in schema order. Raises
+        ValueError if one of them is not a field of the schema.
+        '''
+        unknown = set(fields) - set(self.fields)
+        if unknown:
+            raise ValueError(f'unknown fields: {", ".join(sorted(unknown))}')
+        fields = tuple(field for field in self.fields if field in fields)
+        if fields == self.fields:
+            return self
+        subset = self._subsets.get(fields)
+        if subset is None:
+            subset = Schema(self.model, fields)
+            subset._embeds = self._embeds
+            subset = self._subsets.setdefault(fields, subset)
+        return subset
+
+    def columns_with(self, *fields):
+        '''
+        The columns of the schema, followed by those of fields it leaves
+        out: columns that pagination or embedding read but the response
+        does not include.
+        '''
+        missing = [field for field in dict.fromkeys(fields)
+                   if field not in self.fields]
+        return self.columns + tuple(getattr(self.model, field)
+                                    for field in missing)
+
+    def dump(self, row):
+        return dict(zip(self.fields, self._values(row)))
+
+    def related_query(self, name, ids):
+        schema, owner_key, target_key = self._embeds[name]
+        return (select(owner_key.label('owner_id'), *schema.columns)
+                .join(schema.model, schema.model.id == target_key)
+                .where(owner_key.in_(ids))
+                .order_by(owner_key, schema.model.id))
+
+    def dump_all(self, rows, related=None):
+        '''
+        Dumps rows, embedding related: {name: rows of related_query(name)}.
+        '''
+        if not related:
+            return [self.dump(row) for row in rows]
+        embedded = {}
+        for name, related_rows in related.items():
+            schema = self._embeds[name][0]
+            by_owner = embedded[name] = defaultdict(list)
+            for related_row in related_rows:
+                by_owner[related_row.owner_id].append(
+                    schema.dump(related_row))
+        dumped = []
+        for row in rows:
+            data = self.dump(row)
+            for name, by_owner in embedded.items():
+                data[name] = by_owner.get(row.id, [])
+            dumped.append(data)
+        return dumped
+
+
+movie_schema = Schema(Movie, ('id', 'title', 'release_date',
+                              'shooting_start', 'shooting_end', 'version'))
+actor_schema = Schema(Actor, ('id', 'name', 'age', 'gender', 'version'))
+movie_schema.embed('actors', actor_schema, Cast.movie_id, Cast.actor_id)
+actor_schema.embed('movies', movie_schema, Cast.actor_id, Cast.movie_id)
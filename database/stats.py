@@ -0,0 +1,107 @@
+from collections import Counter
+
+from sqlalchemy import Integer, cast, delete, extract, func, select
+
+from database.models import (AGE_BUCKET, ROLLUPS, STATS_ROLLUPS, Actor, Movie,
+                             Rollup, db)
+
+
+'''
+Statistics
+    Row counts of movies per release year and of actors per age bucket
+    (AGE_BUCKET years wide) and gender. They are read from the Rollup table
+    when STATS_ROLLUPS is set, and otherwise aggregated with GROUP BY
+    queries, which the (release_date, id) and (gender, age) indexes cover.
+    Either way a dimension is a dict from its bucket, as stored in Rollup
+    ('' for NULL), to its count.
+'''
+
+
+def _bucket(value):
+    return '' if value is None else str(int(value))
+
+
+def _age_bucket():
+    if db.engine.dialect.name == 'postgresql':
+        return func.floor(Actor.age / AGE_BUCKET) * AGE_BUCKET
+    # SQLite has no floor() without its math extension; ages are never
+    # negative, so truncating is the same
+    return cast(Actor.age / AGE_BUCKET, Integer) * AGE_BUCKET
+
+
+def _grouped(expression, bucket=_bucket):
+    counts = Counter()
+    for value, count in db.session.execute(
+            select(expression, func.count()).group_by(expression)):
+        counts[bucket(value)] += count
+    return dict(counts)
+
+
+def aggregate(kind):
+    '''Counts every dimension of kind with GROUP BY queries.'''
+    if kind == 'movies':
+        return {'year': _grouped(extract('year', Movie.release_date))}
+    return {'age': _grouped(_age_bucket()),
+            'gender': _grouped(Actor.gender, lambda gender: gender or '')}
+
+
+def read_rollups(kind):
+    counts = {dimension: {} for dimension in ROLLUPS[kind]}
+    for dimension, value, count in db.session.execute(
+            select(Rollup.dimension, Rollup.value, Rollup.count)
+            .where(Rollup.kind == kind, Rollup.count != 0)):
+        counts[dimension][value] = count
+    return counts
+
+
+def counts(kind):
+    return read_rollups(kind) if STATS_ROLLUPS else aggregate(kind)
+
+
+def rebuild_rollups():
+    '''
+    Recomputes the Rollup table from the movies and actors in one
+    transaction, e.g. after turning STATS_ROLLUPS on.
+    '''
+    try:
+        db.session.execute(delete(Rollup))
+        for kind in ROLLUPS:
+            Rollup.add(kind, {
+                (dimension, value): count
+                for dimension, buckets in aggregate(kind).items()
+                for value, count in buckets.items()})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _number(bucket):
+    return int(bucket) if bucket else None
+
+
+def movie_stats():
+    per_year = counts('movies')['year']
+    return {
+        'total': sum(per_year.values()),
+        'per_year': [{'year': _number(year), 'count': per_year[year]}
+                     for year in sorted(per_year, key=lambda year: (
+                         year == '', _number(year) or 0))]
+    }
+
+
+def actor_stats():
+    actor_counts = counts('actors')
+    ages = actor_counts['age']
+    genders = actor_counts['gender']
+    return {
+        'total': sum(genders.values()),
+        'age_distribution': [
+            {'from': _number(age),
+             'to': _number(age) + AGE_BUCKET if age else None,
+             'count': ages[age]}
+            for age in sorted(ages, key=lambda age: (
+                age == '', _number(age) or 0))],
+        'genders': [{'gender': gender or None, 'count': genders[gender]}
+                    for gender in sorted(genders)]
+    }
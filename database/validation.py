@@ -0,0 +1,126 @@
+from datetime import date
+
+
+class ValidationError(ValueError):
+    pass
+
+
+'''
+parse_movie(data, partial=False) / parse_actor(data, partial=False)
+    Check a JSON object sent by a client and return the column values to
+    write. With partial=True (PATCH) only the supplied fields are checked
+    and returned, but at least one is required. A movie's shooting_start and
+    shooting_end are optional, but sent together: both dates or both null.
+    Raise ValidationError describing the first problem found.
+'''
+
+
+def _check_fields(data, fields, partial, optional=()):
+    if not isinstance(data, dict):
+        raise ValidationError('expected a JSON object')
+    unknown = set(data) - set(fields) - set(optional)
+    if unknown:
+        raise ValidationError(f'unknown field {sorted(unknown)[0]}')
+    if partial:
+        if not data:
+            raise ValidationError('no fields to update')
+    else:
+        for field in fields:
+            if field not in data:
+                raise ValidationError(f'{field} is required')
+
+
+def _non_empty_string(data, field):
+    value = data[field]
+    if not isinstance(value, str) or not value.strip():
+        raise ValidationError(f'{field} cannot be null')
+    return value
+
+
+def parse_date(data, field):
+    try:
+        return date.fromisoformat(_non_empty_string(data, field))
+    except ValueError:
+        raise ValidationError(f'{field} must be YYYY-MM-DD')
+
+
+def parse_movie(data, partial=False):
+    _check_fields(data, ('title', 'release_date'), partial,
+                  optional=('shooting_start', 'shooting_end'))
+    values = {}
+    if 'title' in data:
+        values['title'] = _non_empty_string(data, 'title')
+    if 'release_date' in data:
+        values['release_date'] = parse_date(data, 'release_date')
+    window = ('shooting_start', 'shooting_end')
+    if any(field in data for field in window):
+        # both or neither: a half window books nobody
+        if not all(field in data for field in window) or \
+                (data['shooting_start'] is None) != \
+                (data['shooting_end'] is None):
+            raise ValidationError(
+                'shooting_start and shooting_end go together')
+        for field in window:
+            values[field] = (parse_date(data, field)
+                             if data[field] is not None else None)
+    if (values.get('shooting_start') and values.get('shooting_end')
+            and values['shooting_start'] > values['shooting_end']):
+        raise ValidationError('shooting_end is before shooting_start')
+    return values
+
+
+def parse_actor(data, partial=False):
+    _check_fields(data, ('name', 'age', 'gender'), partial)
+    values = {}
+    if 'name' in data:
+        values['name'] = _non_empty_string(data, 'name')
+    if 'age' in data:
+        age = data['age']
+        if (isinstance(age, bool) or not isinstance(age, (int, float))
+                or age < 0):
+            raise ValidationError('age must be a non-negative number')
+        values['age'] = age
+    if 'gender' in data:
+        values['gender'] = _non_empty_string(data, 'gender')
+    return values
+
+
+class PreconditionRequired(ValidationError):
+    pass
+
+
+'''
+parse_precondition(if_match, data)
+    Returns the row versions a PATCH may apply to and its body data without
+    the version field. They come from the If-Match ETags (those of a single
+    movie or actor begin with its version; a weak W/ tag, as sent with a
+    compressed body, matches too) or else from that version field.
+    If-Match: * gives None, for an unconditional update.
+    Raise PreconditionRequired when neither is sent, ValidationError for an
+    invalid version field.
+'''
+
+
+def _tag_version(tag):
+    version, _, _ = tag.partition('-')
+    return int(version) if version.isdigit() else None
+
+
+def parse_precondition(if_match, data):
+    if isinstance(data, dict) and 'version' in data:
+        data = dict(data)
+        version = data.pop('version')
+        if (isinstance(version, bool) or not isinstance(version, int)
+                or version < 1):
+            raise ValidationError('version must be a positive integer')
+    else:
+        version = None
+    if if_match:
+        if if_match.star_tag:
+            return None, data
+        versions = {_tag_version(tag)
+                    for tag in if_match.as_set(include_weak=True)}
+        return tuple(sorted(versions - {None})), data
+    if version is None:
+        raise PreconditionRequired('If-Match or version is required')
+    return (version,), data
@@ -0,0 +1,11 @@
+from prometheus_client import multiprocess
+
+from instrumentation import metrics
+
+
+def child_exit(server, worker):
+    # drop the live gauges of a worker that is gone (instrumentation.metrics);
+    # without a multiprocess directory there are none
+    if not (metrics.METRICS and metrics.PROMETHEUS_MULTIPROC_DIR):
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,187 @@
+import hmac
+import os
+import threading
+import time
+
+from flask import Response, abort, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Serve /metrics (off by default: it tells anyone who can reach it about
+# the traffic, auth failures and pools of the service).
+METRICS = os.environ.get('METRICS', '') in ('1', 'true')
+# Bearer token required by /metrics; unset leaves it open (keep it off the
+# public load balancer then).
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Set for gunicorn (and created empty before it starts): every worker keeps
+# its values in files there and a scrape adds them up.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+REQUESTS = Counter('http_requests_total',
+                   'Responses sent, by route and status code',
+                   ['method', 'route', 'status'])
+LATENCY = Histogram('http_request_duration_seconds',
+                    'Time to produce a response, by route',
+                    ['method', 'route'])
+AUTH_RESULTS = Counter('auth_results_total',
+                       'Token checks, by outcome: ok or the AuthError code',
+                       ['result'])
+CACHE_LOOKUPS = Counter('cache_lookups_total',
+                        'Response and token cache lookups, by result',
+                        ['cache', 'result'])
+QUERY_LATENCY = Histogram('db_query_duration_seconds',
+                          'SQL statement execution time',
+                          buckets=(.001, .0025, .005, .01, .025, .05, .1,
+                                   .25, .5, 1, 2.5, 5, 10))
+POOL_SIZE = Gauge('db_pool_size', 'Connections kept open by each pool',
+                  ['bind'], multiprocess_mode='livesum')
+POOL_OPEN = Gauge('db_pool_open_connections',
+                  'Connections currently open, by pool', ['bind'],
+                  multiprocess_mode='livesum')
+POOL_CHECKED_OUT = Gauge('db_pool_checked_out_connections',
+                         'Connections currently in use, by pool', ['bind'],
+                         multiprocess_mode='livesum')
+
+_enabled = False
+_cache_counters = None
+
+'''
+CacheCounters
+    Moves the hits and misses the caches count as plain integers into
+    CACHE_LOOKUPS, once per request, so that the cache lookups themselves
+    never wait on a metrics lock.
+'''
+
+
+class CacheCounters:
+    def __init__(self, caches):
+        self.caches = caches
+        self._flushed = {}
+        self._lock = threading.Lock()
+
+    def flush(self):
+        with self._lock:
+            for name, cache in self.caches.items():
+                stats = cache.stats()
+                for result in ('hits', 'misses'):
+                    last = self._flushed.get((name, result), 0)
+                    if stats[result] < last:
+                        # the cache was cleared
+                        last = 0
+                    if stats[result] > last:
+                        CACHE_LOOKUPS.labels(name, result).inc(
+                            stats[result] - last)
+                    self._flushed[(name, result)] = stats[result]
+
+
+def count_auth(result):
+    '''
+    Counts one token check: 'ok', or the code of the AuthError raised.
+    '''
+    if _enabled:
+        AUTH_RESULTS.labels(result).inc()
+
+
+def _query_started(conn, cursor, statement, parameters, context,
+                   executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _query_finished(conn, cursor, statement, parameters, context,
+                    executemany):
+    started = conn.info.get('metrics_started')
+    if started:
+        QUERY_LATENCY.observe(time.perf_counter() - started.pop())
+
+
+def _query_failed(context):
+    started = context.connection.info.get('metrics_started')
+    if started:
+        started.pop()
+
+
+def watch_pool(engine, bind):
+    '''
+    Keeps the pool gauges of engine up to date under the label bind.
+    '''
+    size = getattr(engine.pool, 'size', None)
+    if size is not None:
+        POOL_SIZE.labels(bind).set(size())
+    open_connections = POOL_OPEN.labels(bind)
+    checked_out = POOL_CHECKED_OUT.labels(bind)
+    event.listen(engine, 'connect', lambda *args: open_connections.inc())
+    event.listen(engine, 'close', lambda *args: open_connections.dec())
+    event.listen(engine, 'checkout', lambda *args: checked_out.inc())
+    event.listen(engine, 'checkin', lambda *args: checked_out.dec())
+
+
+def exposition():
+    '''
+    The current values in the Prometheus text format, summed over every
+    worker in multiprocess mode.
+    '''
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry),
+                    content_type=CONTENT_TYPE_LATEST)
+
+
+def observe_request(method, url_rule, status, started):
+    '''
+    Records one response of the route url_rule (None when no route
+    matched), started at time.perf_counter() value started.
+    '''
+    route = url_rule.rule if url_rule else 'unmatched'
+    LATENCY.labels(method, route).observe(time.perf_counter() - started)
+    REQUESTS.labels(method, route, status).inc()
+    if _cache_counters is not None:
+        _cache_counters.flush()
+
+
+def init_app(app, engines, caches):
+    '''
+    Serves /metrics from app and records its requests, the queries and
+    pools of the engines returned by engines() (bind key: engine, called
+    on the first request, once the database is set up) and the lookups of
+    caches (name: object with stats()).
+    '''
+    global _enabled, _cache_counters
+    _enabled = True
+    _cache_counters = CacheCounters(caches)
+    watched = []
+    watch_lock = threading.Lock()
+    if not event.contains(Engine, 'before_cursor_execute', _query_started):
+        event.listen(Engine, 'before_cursor_execute', _query_started)
+        event.listen(Engine, 'after_cursor_execute', _query_finished)
+        event.listen(Engine, 'handle_error', _query_failed)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        if not watched:
+            with watch_lock:
+                if not watched:
+                    for bind, engine in engines().items():
+                        watch_pool(engine, bind or 'primary')
+                    watched.append(True)
+
+    @app.after_request
+    def record_request(response):
+        if 'metrics_started' in g:
+            observe_request(request.method, request.url_rule,
+                            response.status_code, g.metrics_started)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        if METRICS_TOKEN and not hmac.compare_digest(
+                request.headers.get('Authorization', ''),
+                f'Bearer {METRICS_TOKEN}'):
+            abort(401)
+        return exposition()
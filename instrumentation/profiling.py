@@ -0,0 +1,178 @@
+import cProfile
+import itertools
+import os
+import random
+import re
+import time
+from contextlib import nullcontext
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from database.serializers import JSONProvider
+
+# Time the phases of every request into a Server-Timing header.
+PROFILE = os.environ.get('PROFILE', '') in ('1', 'true')
+# Share of the requests (0 to 1) also run under a profiler, whose dump is
+# written to PROFILE_DIR.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# cprofile (.prof files for pstats/snakeviz) or pyinstrument (.html).
+PROFILER = os.environ.get('PROFILER', 'cprofile')
+
+# Order of the phases in the header; total comes last.
+PHASES = ('auth', 'jwks', 'jwt', 'db', 'serialize')
+
+_enabled = False
+_untimed = nullcontext()
+_dumps = itertools.count()
+
+
+class _Phase:
+    __slots__ = ('timings', 'name', 'started')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timings[self.name] = (self.timings.get(self.name, 0) +
+                                   time.perf_counter() - self.started)
+
+
+def timing(name):
+    '''
+    Context manager adding the time spent in its block to the phase name of
+    the current request. Returns one shared no-op unless profiling is on.
+    '''
+    if not _enabled or not has_request_context() or 'timings' not in g:
+        return _untimed
+    return _Phase(g.timings, name)
+
+
+'''
+TimedJSONProvider
+    The app's JSON provider, timing jsonify as the serialize phase.
+'''
+
+
+class TimedJSONProvider(JSONProvider):
+    def response(self, *args, **kwargs):
+        with timing('serialize'):
+            return super().response(*args, **kwargs)
+
+
+def _query_started(conn, cursor, statement, parameters, context,
+                   executemany):
+    if has_request_context() and 'timings' in g:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _query_finished(conn, cursor, statement, parameters, context,
+                    executemany):
+    started = conn.info.get('query_started')
+    if started and has_request_context() and 'timings' in g:
+        g.timings['db'] = (g.timings.get('db', 0) +
+                           time.perf_counter() - started.pop())
+        g.queries += 1
+
+
+def _query_failed(context):
+    started = context.connection.info.get('query_started')
+    if started and has_request_context() and 'timings' in g:
+        started.pop()
+
+
+def _start_profiler():
+    if PROFILER == 'pyinstrument':
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another request's profiler is already running
+        return None
+    return profiler
+
+
+def _dump_profile(profiler, total):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, '{}-{}-{}-{:.0f}ms-{}-{}'.format(
+        time.strftime('%Y%m%dT%H%M%S'), request.method,
+        re.sub(r'\W+', '_', request.path).strip('_') or 'root',
+        total * 1000, os.getpid(), next(_dumps)))
+    if PROFILER == 'pyinstrument':
+        profiler.stop()
+        with open(path + '.html', 'w') as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        profiler.dump_stats(path + '.prof')
+
+
+def start_request():
+    g.timings = {}
+    g.queries = 0
+    g.profiler = (_start_profiler()
+                  if random.random() < PROFILE_SAMPLE_RATE else None)
+    g.request_started = time.perf_counter()
+
+
+def server_timing(timings, queries, total):
+    metrics = []
+    for name in PHASES:
+        if name in timings:
+            description = f';desc="queries={queries}"' if name == 'db' else ''
+            metrics.append(
+                f'{name};dur={timings[name] * 1000:.2f}{description}')
+    metrics.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(metrics)
+
+
+def finish_request(response):
+    if 'request_started' not in g:
+        return response
+    total = time.perf_counter() - g.request_started
+    response.headers['Server-Timing'] = server_timing(g.timings, g.queries,
+                                                      total)
+    if g.profiler is not None:
+        _dump_profile(g.profiler, total)
+        g.profiler = None
+    return response
+
+
+def discard_profiler(exception):
+    # a request that failed before its after_request hooks
+    if g.get('profiler') is not None:
+        if PROFILER == 'pyinstrument':
+            g.profiler.stop()
+        else:
+            g.profiler.disable()
+        g.profiler = None
+
+
+def init_app(app):
+    '''
+    Times the auth, JWKS, JWT verification, database and serialization
+    phases of every request of app, reported in a Server-Timing header, and
+    samples PROFILE_SAMPLE_RATE of them into profiler dumps. Nothing is
+    hooked in unless this is called.
+    '''
+    global _enabled
+    _enabled = True
+    app.json = TimedJSONProvider(app)
+    if not event.contains(Engine, 'before_cursor_execute', _query_started):
+        event.listen(Engine, 'before_cursor_execute', _query_started)
+        event.listen(Engine, 'after_cursor_execute', _query_finished)
+        event.listen(Engine, 'handle_error', _query_failed)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(discard_profiler)
@@ -0,0 +1,182 @@
+import os
+import zlib
+
+from flask import request
+
+from database.cache import response_cache
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # optional: pip install zstandard
+    zstandard = None
+
+# Compress responses for clients that accept it (on by default).
+COMPRESSION = os.environ.get('COMPRESSION', '1') not in ('0', 'false')
+# Smaller bodies are sent as they are: the saving would not pay for the
+# work.
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+# Content codings in order of preference, where the client accepts several;
+# br and zstd are only offered when their module is installed.
+COMPRESS_CODINGS = os.environ.get('COMPRESS_CODINGS', 'zstd,br,gzip')
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+ZSTD_LEVEL = int(os.environ.get('ZSTD_LEVEL', 3))
+
+COMPRESSIBLE = ('application/json', 'application/x-ndjson')
+
+_installed = {'gzip': True, 'br': brotli is not None,
+              'zstd': zstandard is not None}
+CODINGS = [coding.strip() for coding in COMPRESS_CODINGS.split(',')
+           if _installed.get(coding.strip())]
+
+
+def negotiate(accept_encodings):
+    '''
+    The coding to compress with for a client sending the parsed
+    Accept-Encoding accept_encodings, or None to send the body as it is.
+    '''
+    if not COMPRESSION:
+        return None
+    return accept_encodings.best_match(CODINGS)
+
+
+def compressible(response):
+    return (response.mimetype in COMPRESSIBLE or
+            response.mimetype.startswith('text/'))
+
+
+def compress(body, coding):
+    if coding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if coding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return zlib.compress(body, GZIP_LEVEL, wbits=31)
+
+
+'''
+Compressor
+    Incremental compression of a streamed body: every chunk passed to
+    compress() comes back flushed, so the client can decode each batch as
+    soon as it arrives rather than when the stream ends.
+'''
+
+
+class Compressor:
+    def __init__(self, coding):
+        self.coding = coding
+        if coding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        elif coding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(
+                level=ZSTD_LEVEL).compressobj()
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED,
+                                                31)
+
+    def compress(self, chunk):
+        if self.coding == 'br':
+            return (self._compressor.process(chunk) +
+                    self._compressor.flush())
+        if self.coding == 'zstd':
+            return (self._compressor.compress(chunk) +
+                    self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK))
+        return (self._compressor.compress(chunk) +
+                self._compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def finish(self):
+        if self.coding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress_stream(chunks, coding):
+    compressor = Compressor(coding)
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield compressor.compress(chunk)
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+async def compress_stream_async(chunks, coding):
+    compressor = Compressor(coding)
+    try:
+        async for chunk in chunks:
+            if chunk:
+                yield compressor.compress(chunk)
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, 'aclose'):
+            await chunks.aclose()
+
+
+def mark_encoded(response, coding):
+    '''
+    Labels response, whose body is compressed with coding. Its ETag turns
+    weak: the bytes differ from those of the uncompressed representation.
+    '''
+    response.headers['Content-Encoding'] = coding
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def wants_compression(response, accept_encodings):
+    '''
+    The coding to compress response with, or None. Sets Vary on every
+    response that could have been compressed for another client.
+    '''
+    if response.status_code < 200 or \
+            response.status_code in (204, 206, 304) or \
+            'Content-Encoding' in response.headers or \
+            not compressible(response):
+        return None
+    response.vary.add('Accept-Encoding')
+    return negotiate(accept_encodings)
+
+
+def precompressed(entry, key, accept_encodings):
+    '''
+    The body to send for the cached entry stored under key, and its coding
+    (None when sent as it is). Compressed bodies are stored in the response
+    cache next to the entry, so a hot page is compressed once per coding
+    rather than on every request.
+    '''
+    coding = negotiate(accept_encodings)
+    if coding is None or len(entry.body) < COMPRESS_MIN_SIZE:
+        return entry.body, None
+    return response_cache.encoded(
+        key, entry, coding, lambda body: compress(body, coding)), coding
+
+
+def compress_response(response):
+    coding = wants_compression(response, request.accept_encodings)
+    if coding is None or response.direct_passthrough:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, coding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(body, coding))
+    mark_encoded(response, coding)
+    return response
+
+
+def init_app(app):
+    '''
+    Compresses the JSON and NDJSON responses of app with the best coding
+    the client accepts: bodies of COMPRESS_MIN_SIZE bytes or more whole,
+    streamed ones chunk by chunk.
+    '''
+    app.after_request(compress_response)
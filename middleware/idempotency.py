@@ -0,0 +1,139 @@
+import hashlib
+import os
+from datetime import timedelta
+from functools import wraps
+
+from flask import Response, current_app, g, request
+
+from database.models import IdempotencyKey, utcnow
+
+# Seconds the response of a request sent with an Idempotency-Key is
+# replayed to retries with the same key.
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+# Seconds after which a request that never completed (its worker died)
+# gives its key up to a retry.
+IDEMPOTENCY_LOCK_TTL = float(os.environ.get('IDEMPOTENCY_LOCK_TTL', 60))
+MAX_KEY_LENGTH = 255
+
+HEADER = 'Idempotency-Key'
+
+
+class IdempotencyError(Exception):
+    '''
+    A request whose Idempotency-Key cannot be honoured: 400 for a malformed
+    key, 409 while the first request with the key is still running (retry
+    after retry_after seconds), 422 for a key reused with another request.
+    '''
+    messages = {400: 'invalid Idempotency-Key',
+                409: 'a request with this Idempotency-Key is in progress',
+                422: 'Idempotency-Key reused with a different request'}
+
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.message = self.messages[status_code]
+        self.retry_after = retry_after
+
+
+def client_key(payload, key):
+    '''
+    The client of a verified token payload (its sub, or azp for tokens
+    without one) and key, checked. Keys are scoped per client.
+    '''
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(400)
+    return payload.get('sub') or payload.get('azp') or '', key
+
+
+def fingerprint(method, path, body):
+    digest = hashlib.sha256(f'{method} {path}\n'.encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def claim(client, key, request_fingerprint):
+    '''
+    Claims key for a request. Returns None when this request won it and
+    must run, then call finish or abandon; or the (status, body) stored for
+    a completed request, to replay. Expired keys are taken over.
+    '''
+    for _ in range(2):
+        if IdempotencyKey.claim(client, key, request_fingerprint):
+            return None
+        stored = IdempotencyKey.lookup(client, key)
+        if stored is None:
+            # released in between
+            continue
+        age = (utcnow() - stored.created_at).total_seconds()
+        if age > (IDEMPOTENCY_TTL if stored.status is not None
+                  else IDEMPOTENCY_LOCK_TTL):
+            IdempotencyKey.release(client, key, stored.created_at)
+            continue
+        if stored.fingerprint != request_fingerprint:
+            raise IdempotencyError(422)
+        if stored.status is None:
+            raise IdempotencyError(409, retry_after=1)
+        return stored.status, stored.body
+    raise IdempotencyError(409, retry_after=1)
+
+
+def finish(client, key, status, body):
+    '''
+    Stores the response of the request holding key. Server errors are not
+    stored: the key is released, so that a retry runs the request again.
+    '''
+    if status >= 500:
+        IdempotencyKey.release(client, key)
+    else:
+        IdempotencyKey.complete(client, key, status, body)
+
+
+def abandon(client, key):
+    IdempotencyKey.release(client, key)
+
+
+def replay(stored, response_class=Response):
+    '''
+    The response replayed for the (status, body) stored by a completed
+    request, marked with an Idempotent-Replayed header.
+    '''
+    status, body = stored
+    response = response_class(body, status=status,
+                              mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def purge():
+    '''Deletes the keys older than IDEMPOTENCY_TTL.'''
+    return IdempotencyKey.purge(utcnow() - timedelta(seconds=IDEMPOTENCY_TTL))
+
+
+def idempotent(f):
+    '''
+    Makes the create handler f (below requires_auth) idempotent for
+    requests with an Idempotency-Key header: the first request with a key
+    runs, and retries get its stored response back, marked with an
+    Idempotent-Replayed header, without running f again. The request body
+    is read whole, to fingerprint it.
+    '''
+    @wraps(f)
+    def wrapper(payload, *args, **kwargs):
+        if HEADER not in request.headers:
+            return f(payload, *args, **kwargs)
+        client, key = client_key(payload, request.headers[HEADER])
+        # kept for bulk_items, which would otherwise read the stream
+        g.request_body = request.get_data()
+        stored = claim(client, key, fingerprint(
+            request.method, request.full_path, g.request_body))
+        if stored is not None:
+            return replay(stored)
+
+        try:
+            response = current_app.make_response(f(payload, *args, **kwargs))
+        except BaseException:
+            abandon(client, key)
+            raise
+        finish(client, key, response.status_code, response.get_data())
+        return response
+
+    return wrapper
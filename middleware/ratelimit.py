@@ -0,0 +1,231 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+from flask import g, request
+
+from database.cache import CACHE_BACKEND, CACHE_URL
+
+# Token buckets per client and permission, as comma separated
+# permission=rate:burst items: rate requests per second on average, up to
+# burst at once (default: rate). A permission may contain * (post:*); the
+# first match applies and its bucket is shared by every permission it
+# matches. Unset, requests are not rate limited.
+RATE_LIMITS = os.environ.get('RATE_LIMITS', '')
+# memory (per process) or redis (shared by the workers, on CACHE_URL);
+# redis by default when the response cache is.
+RATE_LIMIT_BACKEND = os.environ.get(
+    'RATE_LIMIT_BACKEND', 'redis' if CACHE_BACKEND == 'redis' else 'memory')
+# Maximum number of buckets the memory backend keeps.
+RATE_LIMIT_BUCKETS = int(os.environ.get('RATE_LIMIT_BUCKETS', 10000))
+# Requests a process serves at once; any more are answered 503 at once
+# rather than queued. 0 for no limit.
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 0))
+# Retry-After, in seconds, of those 503 responses.
+BUSY_RETRY_AFTER = int(os.environ.get('BUSY_RETRY_AFTER', 1))
+
+# Not admission controlled, so that the server can be watched under load.
+UNLIMITED_PATHS = ('/metrics',)
+
+
+class Throttled(Exception):
+    '''
+    A request turned away: 429 when its client is over its rate limit, 503
+    when the process is at MAX_IN_FLIGHT. retry_after is in seconds.
+    '''
+    messages = {429: 'too many requests', 503: 'server busy'}
+
+    def __init__(self, status_code, retry_after):
+        self.status_code = status_code
+        self.message = self.messages[status_code]
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def parse_limits(spec):
+    '''
+    The (permission pattern, rate, burst) triples of a RATE_LIMITS value.
+    '''
+    limits = []
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        pattern, _, limit = item.partition('=')
+        rate, _, burst = limit.partition(':')
+        rate = float(rate)
+        limits.append((pattern.strip(), rate,
+                       float(burst) if burst else max(rate, 1)))
+    return limits
+
+
+'''
+MemoryBuckets
+    Token buckets of one process, LRU bounded: a client evicted for
+    inactivity starts again with a full bucket.
+'''
+
+
+class MemoryBuckets:
+    def __init__(self, maxsize=RATE_LIMIT_BUCKETS):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        '''
+        Takes a token from the bucket key, refilled at rate per second up
+        to burst. Returns 0, or the seconds until a token is available when
+        the bucket is empty.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+'''
+RedisBuckets
+    The same buckets in Redis, shared by every worker: each take is one
+    atomic script run, timed by the Redis clock.
+'''
+
+
+class RedisBuckets:
+    script = '''
+        local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local clock = redis.call('TIME')
+        local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or burst
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(wait)
+    '''
+
+    def __init__(self, client):
+        self._take = client.register_script(self.script)
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def take(self, key, rate, burst):
+        return float(self._take(keys=[key], args=[rate, burst]))
+
+
+'''
+Limiter
+    Applies the first of limits matching the permission a request is
+    authorized with to the bucket of its client: the token's sub, or azp
+    for tokens without one.
+'''
+
+
+class Limiter:
+    def __init__(self, limits, buckets):
+        self.limits = limits
+        self.buckets = buckets
+        self._matches = {}
+
+    def _limit(self, permission):
+        if permission not in self._matches:
+            self._matches[permission] = next(
+                (limit for limit in self.limits
+                 if fnmatchcase(permission, limit[0])), None)
+        return self._matches[permission]
+
+    def check(self, permission, payload):
+        '''
+        Raises Throttled (429) when the client of payload is over the rate
+        limit of permission.
+        '''
+        if not self.limits:
+            return
+        limit = self._limit(permission)
+        client = payload.get('sub') or payload.get('azp')
+        if limit is None or client is None:
+            return
+        pattern, rate, burst = limit
+        wait = self.buckets.take(f'rate:{pattern}:{client}', rate, burst)
+        if wait > 0:
+            raise Throttled(429, wait)
+
+
+def make_limiter():
+    limits = parse_limits(RATE_LIMITS)
+    if limits and RATE_LIMIT_BACKEND == 'redis':
+        return Limiter(limits, RedisBuckets.from_url(CACHE_URL))
+    return Limiter(limits, MemoryBuckets())
+
+
+limiter = make_limiter()
+
+'''
+Admission
+    Caps the requests of a process in flight at limit. A request over the
+    cap is refused at once, so a burst of slow requests (say whole-table
+    streams) fails fast with 503 instead of queueing every worker thread
+    until clients time out.
+'''
+
+
+class Admission:
+    def __init__(self, limit=MAX_IN_FLIGHT):
+        self._slots = threading.BoundedSemaphore(limit)
+
+    def enter(self):
+        if not self._slots.acquire(blocking=False):
+            raise Throttled(503, BUSY_RETRY_AFTER)
+
+    def leave(self):
+        self._slots.release()
+
+
+def init_app(app):
+    '''
+    Admits at most MAX_IN_FLIGHT requests of app at once. A request holds
+    its slot until its response is closed, after the last chunk of a
+    streamed body has been sent.
+    '''
+    if not MAX_IN_FLIGHT:
+        return
+    admission = Admission()
+
+    @app.before_request
+    def admit():
+        if request.path not in UNLIMITED_PATHS:
+            admission.enter()
+            g.admitted = True
+
+    @app.after_request
+    def release_on_close(response):
+        if g.pop('admitted', False):
+            response.call_on_close(admission.leave)
+        return response
+
+    @app.teardown_request
+    def release(exception):
+        # a request that failed before its after_request hooks
+        if g.pop('admitted', False):
+            admission.leave()
@@ -0,0 +1,40 @@
+"""search trigram indexes
+
+Revision ID: 01d06a278fe4
+Revises: a32cc495f31d
+Create Date: 2026-10-18 11:00:00.000000
+
+GIN pg_trgm indexes behind GET /search on Postgres. Other databases search
+with the in-process index in database/search.py.
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '01d06a278fe4'
+down_revision = 'a32cc495f31d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        op.create_index('ix_Movie_title_trgm', 'Movie', ['title'],
+                        postgresql_using='gin',
+                        postgresql_ops={'title': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+        op.create_index('ix_Actor_name_trgm', 'Actor', ['name'],
+                        postgresql_using='gin',
+                        postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_Actor_name_trgm', table_name='Actor')
+    op.drop_index('ix_Movie_title_trgm', table_name='Movie')
@@ -0,0 +1,34 @@
+"""stats rollups
+
+Revision ID: 1d54cd7269ca
+Revises: 75be6d878867
+Create Date: 2026-10-18 12:30:00.000000
+
+Rollup counts behind GET /stats when STATS_ROLLUPS is set. The table starts
+empty: run flask rebuild-rollups before turning STATS_ROLLUPS on.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d54cd7269ca'
+down_revision = '75be6d878867'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'Rollup',
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('dimension', sa.String(), nullable=False),
+        sa.Column('value', sa.String(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'dimension', 'value')
+    )
+
+
+def downgrade():
+    op.drop_table('Rollup')
@@ -0,0 +1,40 @@
+"""idempotency keys
+
+Revision ID: 3f9a6c2e8b17
+Revises: 1d54cd7269ca
+Create Date: 2026-10-18 15:00:00.000000
+
+Stored outcomes of the create requests sent with an Idempotency-Key header.
+Delete the expired ones with flask purge-idempotency-keys.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a6c2e8b17'
+down_revision = '1d54cd7269ca'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'IdempotencyKey',
+        sa.Column('client', sa.String(), nullable=False),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('fingerprint', sa.String(), nullable=False),
+        sa.Column('status', sa.Integer(), nullable=True),
+        sa.Column('body', sa.LargeBinary(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('client', 'key')
+    )
+    op.create_index('ix_IdempotencyKey_created_at', 'IdempotencyKey',
+                    ['created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_IdempotencyKey_created_at',
+                  table_name='IdempotencyKey')
+    op.drop_table('IdempotencyKey')
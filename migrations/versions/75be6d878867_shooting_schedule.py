@@ -0,0 +1,46 @@
+"""shooting schedule
+
+Revision ID: 75be6d878867
+Revises: c850cfa78e8c
+Create Date: 2026-10-18 12:00:00.000000
+
+Shooting windows on Movie and the bookings they make on Cast. On Postgres
+an exclusion constraint (GiST, needs btree_gist) keeps an actor's bookings
+from overlapping.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '75be6d878867'
+down_revision = 'c850cfa78e8c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Movie', sa.Column('shooting_start', sa.Date(),
+                                     nullable=True))
+    op.add_column('Movie', sa.Column('shooting_end', sa.Date(),
+                                     nullable=True))
+    op.add_column('Cast', sa.Column('starts', sa.Date(), nullable=True))
+    op.add_column('Cast', sa.Column('ends', sa.Date(), nullable=True))
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.create_exclude_constraint(
+        'ex_Cast_actor_booking', 'Cast',
+        ('actor_id', '='),
+        (sa.text("daterange(starts, ends, '[]')"), '&&'),
+        using='gist', where=sa.text('starts IS NOT NULL'))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_constraint('ex_Cast_actor_booking', 'Cast')
+    op.drop_column('Cast', 'ends')
+    op.drop_column('Cast', 'starts')
+    op.drop_column('Movie', 'shooting_end')
+    op.drop_column('Movie', 'shooting_start')
@@ -0,0 +1,33 @@
+"""row versions
+
+Revision ID: 9b3e5d17c2a4
+Revises: 3f9a6c2e8b17
+Create Date: 2026-10-18 18:00:00.000000
+
+Version counters of Movie and Actor, incremented by every update and checked
+by PATCH (If-Match) for optimistic concurrency control. Existing rows start
+at version 1.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3e5d17c2a4'
+down_revision = '3f9a6c2e8b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # a constant default: on Postgres 11+ no table rewrite
+    op.add_column('Movie', sa.Column('version', sa.Integer(), nullable=False,
+                                     server_default='1'))
+    op.add_column('Actor', sa.Column('version', sa.Integer(), nullable=False,
+                                     server_default='1'))
+
+
+def downgrade():
+    op.drop_column('Actor', 'version')
+    op.drop_column('Movie', 'version')
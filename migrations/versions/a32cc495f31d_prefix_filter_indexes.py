@@ -0,0 +1,38 @@
+"""prefix filter indexes
+
+Revision ID: a32cc495f31d
+Revises: fd407850af19
+Create Date: 2026-10-18 10:30:00.000000
+
+text_pattern_ops indexes let Postgres answer the title_prefix and
+name_prefix filters (LIKE 'x%') from an index under any collation. Other
+databases use the plain (title, id) / (name, id) indexes.
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a32cc495f31d'
+down_revision = 'fd407850af19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        op.create_index('ix_Movie_title_pattern', 'Movie', ['title'],
+                        postgresql_ops={'title': 'text_pattern_ops'},
+                        postgresql_concurrently=True)
+        op.create_index('ix_Actor_name_pattern', 'Actor', ['name'],
+                        postgresql_ops={'name': 'text_pattern_ops'},
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_Actor_name_pattern', table_name='Actor')
+    op.drop_index('ix_Movie_title_pattern', table_name='Movie')
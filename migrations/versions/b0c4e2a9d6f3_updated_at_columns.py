@@ -0,0 +1,52 @@
+"""updated_at columns
+
+Revision ID: b0c4e2a9d6f3
+Revises: e7cb8f1a898a
+Create Date: 2026-10-18 10:04:00.000000
+
+The updated_at timestamps behind the ETag and Last-Modified headers of the
+movie and actor GETs. Databases that already have them (built by
+db.create_all() with the current models, or altered by hand) keep theirs.
+The tables that got the column here are listed in UpdatedAtMigration, and
+a downgrade drops it from those only.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b0c4e2a9d6f3'
+down_revision = 'e7cb8f1a898a'
+branch_labels = None
+depends_on = None
+
+TABLES = ('Movie', 'Actor')
+# the tables whose updated_at this revision added
+ADDED = 'UpdatedAtMigration'
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    added = op.create_table(
+        ADDED,
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('table_name')
+    )
+    for table in TABLES:
+        columns = {column['name'] for column in inspector.get_columns(table)}
+        if 'updated_at' in columns:
+            continue
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(),
+                                       nullable=True))
+        op.execute(f'UPDATE "{table}" SET updated_at = CURRENT_TIMESTAMP')
+        op.bulk_insert(added, [{'table_name': table}])
+
+
+def downgrade():
+    added = {row[0] for row in op.get_bind().execute(
+        sa.text(f'SELECT table_name FROM "{ADDED}"'))}
+    for table in reversed(TABLES):
+        if table in added:
+            op.drop_column(table, 'updated_at')
+    op.drop_table(ADDED)
@@ -0,0 +1,35 @@
+"""cast
+
+Revision ID: c850cfa78e8c
+Revises: 01d06a278fe4
+Create Date: 2026-10-18 11:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c850cfa78e8c'
+down_revision = '01d06a278fe4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'Cast',
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('actor_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['actor_id'], ['Actor.id'],
+                                ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['movie_id'], ['Movie.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('movie_id', 'actor_id')
+    )
+    op.create_index('ix_Cast_actor_id', 'Cast', ['actor_id'])
+
+
+def downgrade():
+    op.drop_index('ix_Cast_actor_id', table_name='Cast')
+    op.drop_table('Cast')
@@ -0,0 +1,42 @@
+"""initial schema
+
+Revision ID: e7cb8f1a898a
+Revises: 
+Create Date: 2026-10-18 10:00:00.000000
+
+Databases created by the former db.create_all() at startup already have
+these tables: run `flask db stamp e7cb8f1a898a` once before upgrading.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7cb8f1a898a'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'Movie',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(), nullable=True),
+        sa.Column('release_date', sa.Date(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'Actor',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('age', sa.Numeric(), nullable=True),
+        sa.Column('gender', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('Actor')
+    op.drop_table('Movie')
@@ -0,0 +1,43 @@
+"""catalog indexes
+
+Revision ID: fd407850af19
+Revises: b0c4e2a9d6f3
+Create Date: 2026-10-18 10:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fd407850af19'
+down_revision = 'b0c4e2a9d6f3'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_Movie_release_date_id', 'Movie', ['release_date', 'id']),
+    ('ix_Movie_title_id', 'Movie', ['title', 'id']),
+    ('ix_Movie_updated_at', 'Movie', ['updated_at']),
+    ('ix_Actor_name_id', 'Actor', ['name', 'id']),
+    ('ix_Actor_age_id', 'Actor', ['age', 'id']),
+    ('ix_Actor_gender_age', 'Actor', ['gender', 'age']),
+    ('ix_Actor_updated_at', 'Actor', ['updated_at']),
+]
+
+
+def upgrade():
+    # On Postgres build the indexes without blocking writes to the tables.
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.create_index(name, table, columns,
+                                postgresql_concurrently=True)
+    else:
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
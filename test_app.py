@@ -1,5 +1,11 @@
+import asyncio
+import os
+import threading
+import time
 import unittest
 import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from app import create_app
 from database.models import setup_db
 from constants import executive_producer, invalid_token, DB_USER, DB_PASSWORD, DB_URI
@@ -47,6 +53,115 @@ class CastingTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 403)
         self.assertEqual(data['success'], False)
 
+    def test_get_movies_paginated(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/movies?limit=1&sort=release_date',
+                                headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertLessEqual(len(data['movies']), 1)
+        self.assertIn('next', data)
+
+    def test_get_movies_filtered(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get(
+            '/movies?release_date_from=2020-01-01&sort=-release_date',
+            headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        for movie in data['movies']:
+            self.assertGreaterEqual(movie['release_date'], '2020-01-01')
+
+    def test_get_movies_fields(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/movies?fields=id,title&sort=title',
+                                headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        for movie in data['movies']:
+            self.assertEqual(set(movie), {'id', 'title'})
+
+    def test_get_movies_unknown_field(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/movies?fields=id,budget', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_get_movies_invalid_filter(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/movies?release_date_from=yesterday',
+                                headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_get_actors_non_finite_filter(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        for value in ('nan', 'inf', '-Infinity', 'sNaN'):
+            res = self.client().get(f'/actors?age_min={value}',
+                                    headers=headers)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data['success'], False)
+
+    def test_get_movies_invalid_cursor(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/movies?after=not-a-cursor', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_get_movie_not_modified(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/movies/1', headers=headers)
+        headers['If-None-Match'] = res.headers['ETag']
+        res = self.client().get('/movies/1', headers=headers)
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
     def test_post_movies_200(self):
 
         new_movie = {
@@ -80,6 +195,59 @@ class CastingTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
 
 
+    def test_post_movies_invalid_date(self):
+
+        new_movie = {
+            'title': 'Hello World',
+            'release_date': '20/10/2017'
+        }
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().post('/movies', json=new_movie, headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 'release_date must be YYYY-MM-DD')
+
+    def test_post_movies_bulk_200(self):
+
+        new_movies = [
+            {'title': 'Bulk One', 'release_date': '2019-01-01'},
+            {'title': 'Bulk Two', 'release_date': '2019-02-01'}
+        ]
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().post('/movies/bulk', json=new_movies,
+                                 headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['ids']), 2)
+
+    def test_post_movies_bulk_invalid_item(self):
+
+        new_movies = [
+            {'title': 'Bulk One', 'release_date': '2019-01-01'},
+            {'title': '', 'release_date': '2019-02-01'}
+        ]
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().post('/movies/bulk', json=new_movies,
+                                 headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['errors'][0]['index'], 1)
+
     def test_patch_movies_200(self):
 
         new_movie = {
@@ -90,12 +258,67 @@ class CastingTestCase(unittest.TestCase):
             'Content-Type': 'application/json',
             'Authorization': "Bearer {}".format(executive_producer)
         }
+        res = self.client().get('/movies/2', headers=headers)
+        headers['If-Match'] = res.headers['ETag']
         res = self.client().patch('/movies/2', json=new_movie, headers=headers)
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    def test_patch_movies_stale_version(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/movies/2', headers=headers)
+        headers['If-Match'] = res.headers['ETag']
+        res = self.client().patch('/movies/2', json={'title': 'First'},
+                                  headers=headers)
+        version = json.loads(res.data)['version']
+        res = self.client().patch('/movies/2', json={'title': 'Second'},
+                                  headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 412)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['version'], version)
+
+    def test_patch_movies_without_precondition(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().patch('/movies/2', json={'title': 'Wonderful'},
+                                  headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 428)
+        self.assertEqual(data['success'], False)
+
+    def test_patch_movies_invalid_window(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer),
+            'If-Match': '*'
+        }
+        for window, message in (
+                ({'shooting_start': '2030-02-01',
+                  'shooting_end': '2030-01-01'},
+                 'shooting_end is before shooting_start'),
+                ({'shooting_start': '2030-01-01'},
+                 'shooting_start and shooting_end go together')):
+            res = self.client().patch('/movies/2', json=window,
+                                      headers=headers)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(data['success'], False)
+            self.assertEqual(data['error'], message)
+
     def test_patch_movies_not_found(self):
 
         new_movie = {
@@ -106,6 +329,7 @@ class CastingTestCase(unittest.TestCase):
             'Content-Type': 'application/json',
             'Authorization': "Bearer {}".format(executive_producer)
         }
+        headers['If-Match'] = '*'
         res = self.client().patch('/movies/100', json=new_movie, headers=headers)
         data = json.loads(res.data)
 
@@ -137,8 +361,159 @@ class CastingTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
 
 
+    def test_search_200(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/search?q=Wonderful', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('movies', data)
+        self.assertIn('actors', data)
+
+    def test_search_without_query(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/search', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_assign_actor_200(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().put('/movies/1/actors/1', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+
+        res = self.client().get('/movies/1?include=actors', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(1, [actor['id'] for actor in data['movies']['actors']])
+
+    def test_rename_actor_refreshes_included_movie(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        self.client().put('/movies/1/actors/1', headers=headers)
+        res = self.client().get('/movies/1?include=actors', headers=headers)
+        etag = res.headers['ETag']
+
+        name = 'Renamed {}'.format(uuid.uuid4().hex)
+        res = self.client().patch('/actors/1', json={'name': name},
+                                  headers=dict(headers, **{'If-Match': '*'}))
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get('/movies/1?include=actors',
+                                headers=dict(headers,
+                                             **{'If-None-Match': etag}))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertIn(name, [actor['name']
+                             for actor in data['movies']['actors']])
+
+    def test_assign_actor_404(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().put('/movies/1/actors/100000', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_get_movies_invalid_include(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/movies?include=directors', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+
+    def test_get_movie_stats_200(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/stats/movies', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total'],
+                         sum(year['count'] for year in data['per_year']))
+
+
 # ==========================Actor Test Cases=============================
 
+    def test_get_actor_stats_200(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/stats/actors', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('age_distribution', data)
+        self.assertIn('genders', data)
+
+    def test_get_available_actors_200(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get(
+            '/actors/available?from=2030-01-01&to=2030-01-31',
+            headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('actors', data)
+
+    def test_get_available_actors_without_window(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().get('/actors/available?from=2030-01-01',
+                                headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_get_actors_200(self):
 
         headers = {
@@ -180,6 +555,29 @@ class CastingTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    def test_post_actors_idempotent(self):
+
+        new_actor = {
+            'name': 'Once Only',
+            'age': 40,
+            'gender': 'female'
+        }
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer),
+            'Idempotency-Key': str(uuid.uuid4())
+        }
+        res = self.client().post('/actors', json=new_actor, headers=headers)
+        retry = self.client().post('/actors', json=new_actor, headers=headers)
+        changed = self.client().post('/actors', json=dict(new_actor, age=41),
+                                     headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.data, res.data)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(changed.status_code, 422)
+
     def test_post_actors_null(self):
 
         new_actor = {
@@ -198,6 +596,25 @@ class CastingTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
 
 
+    def test_post_actors_invalid_age(self):
+
+        new_actor = {
+            'name': 'Wonderwomen',
+            'age': -1,
+            'gender': 'female'
+        }
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        res = self.client().post('/actors', json=new_actor, headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 'age must be a non-negative number')
+
+
     def test_patch_actors_200(self):
 
         new_actor = {
@@ -209,11 +626,14 @@ class CastingTestCase(unittest.TestCase):
             'Content-Type': 'application/json',
             'Authorization': "Bearer {}".format(executive_producer)
         }
+        res = self.client().get('/actors/1', headers=headers)
+        new_actor['version'] = json.loads(res.data)['movies']['version']
         res = self.client().patch('/actors/1', json=new_actor, headers=headers)
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
+        self.assertEqual(data['actor']['version'], new_actor['version'] + 1)
 
     def test_patch_actors_not_found(self):
 
@@ -226,6 +646,7 @@ class CastingTestCase(unittest.TestCase):
             'Content-Type': 'application/json',
             'Authorization': "Bearer {}".format(executive_producer)
         }
+        headers['If-Match'] = '*'
         res = self.client().patch('/actors/100', json=new_actor, headers=headers)
         data = json.loads(res.data)
 
@@ -256,6 +677,407 @@ class CastingTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
 
+#========================Profiling================================
+
+    def test_server_timing_header(self):
+        from instrumentation.profiling import server_timing
+
+        header = server_timing({'db': 0.002, 'auth': 0.0001}, 3, 0.01)
+
+        self.assertEqual(header, 'auth;dur=0.10, db;dur=2.00;desc="queries=3", '
+                                 'total;dur=10.00')
+
+#========================Metrics================================
+
+    def test_get_metrics(self):
+        from unittest import mock
+
+        with mock.patch('app.METRICS', True):
+            app = create_app(active=False)
+        app.app_context().push()
+        setup_db(app, self.database_path)
+        client = app.test_client()
+        client.get('/movies/1')
+        res = client.get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'http_requests_total{method="GET",'
+                      b'route="/movies/<int:id>",status="401"}', res.data)
+        self.assertIn(b'auth_results_total{result="authorization_header_missing"}',
+                      res.data)
+
+    def test_get_metrics_off_by_default(self):
+
+        res = self.client().get('/metrics')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_gunicorn_child_exit_without_metrics(self):
+        import importlib.util
+        from types import SimpleNamespace
+        from unittest import mock
+
+        spec = importlib.util.spec_from_file_location('gunicorn_conf',
+                                                      'gunicorn.conf.py')
+        conf = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(conf)
+
+        with mock.patch('instrumentation.metrics.METRICS', False), \
+                mock.patch('instrumentation.metrics.PROMETHEUS_MULTIPROC_DIR',
+                           None), \
+                mock.patch.dict('os.environ'):
+            os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+            conf.child_exit(None, SimpleNamespace(pid=12345))
+
+#========================Rate limiting================================
+
+    def test_rate_limit(self):
+        from middleware.ratelimit import (Limiter, MemoryBuckets, Throttled,
+                                          parse_limits)
+
+        limiter = Limiter(parse_limits('post:*=1:2, get:*=100'),
+                          MemoryBuckets())
+        limiter.check('post:movies', {'sub': 'a'})
+        limiter.check('post:actors', {'sub': 'a'})
+        limiter.check('post:movies', {'sub': 'b'})
+        limiter.check('delete:movies', {'sub': 'a'})
+
+        with self.assertRaises(Throttled) as throttled:
+            limiter.check('post:movies', {'sub': 'a'})
+        self.assertEqual(throttled.exception.status_code, 429)
+        self.assertEqual(throttled.exception.retry_after, 1)
+
+#========================Read replica================================
+
+    def test_reads_stay_on_primary_after_write(self):
+        from database.routing import client_key, record_write, wrote_recently
+
+        headers = {'Authorization': "Bearer {}".format(executive_producer)}
+        other = {'Authorization': "Bearer {}".format(invalid_token)}
+        record_write(client_key(headers))
+
+        self.assertTrue(wrote_recently(client_key(headers)))
+        self.assertFalse(wrote_recently(client_key(other)))
+        self.assertFalse(wrote_recently(client_key({})))
+
+    def test_cache_skipped_after_write(self):
+        from app import cache_mode
+        from database.routing import on_write
+
+        self.assertEqual(cache_mode('movies', None), (True, True))
+        self.assertEqual(cache_mode('movies', False), (False, False))
+        self.assertEqual(cache_mode('actors', True), (True, True))
+        on_write('actors', 'update', [{'id': 1}])
+        self.assertEqual(cache_mode('actors', True), (True, False))
+
+#========================Serialization================================
+
+    def test_serializer_encodes_columns(self):
+        from datetime import date
+        from decimal import Decimal
+        from database.serializers import dumps
+
+        body = dumps({'age': Decimal('35'), 'release_date': date(2030, 1, 2)})
+
+        self.assertEqual(body, b'{"age":35,"release_date":"2030-01-02"}')
+
+    def test_serializer_encodes_non_finite_decimals(self):
+        from decimal import Decimal
+        from unittest import mock
+        from database import serializers
+
+        values = {'nan': Decimal('NaN'), 'inf': Decimal('Infinity'),
+                  'ninf': Decimal('-Infinity')}
+        expected = b'{"nan":null,"inf":null,"ninf":null}'
+
+        self.assertEqual(serializers.dumps(values), expected)
+        with mock.patch.object(serializers, 'orjson', None):
+            self.assertEqual(serializers.dumps(values), expected)
+
+#========================Compression================================
+
+    def test_get_movies_gzip(self):
+        import gzip
+        from unittest import mock
+
+        headers = {
+            'Authorization': "Bearer {}".format(executive_producer),
+            'Accept-Encoding': 'gzip'
+        }
+        # compress whatever few movies the test database holds
+        with mock.patch('middleware.compression.COMPRESS_MIN_SIZE', 1):
+            res = self.client().get('/movies?limit=500', headers=headers)
+        plain = self.client().get('/movies?limit=500', headers={
+            'Authorization': "Bearer {}".format(executive_producer)})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+
+
+
+class AsyncCastingTestCase(unittest.TestCase):
+    """The movie and actor endpoints of the async app (asgi.py)"""
+
+    def setUp(self):
+        from asgi import create_asgi_app
+        from database.async_session import make_async_session
+        self.database_path = "postgresql://{}:{}@{}/{}".format(
+            DB_USER, DB_PASSWORD, DB_URI, "postgres")
+        self.app = create_asgi_app(make_async_session(self.database_path))
+
+    def get(self, path, headers):
+        async def get():
+            res = await self.app.test_client().get(path, headers=headers)
+            return res.status_code, json.loads(await res.get_data())
+        return asyncio.run(get())
+
+    def test_get_movies_200(self):
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': "Bearer {}".format(executive_producer)
+        }
+        status_code, data = self.get('/movies', headers)
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data['success'], True)
+
+    def test_get_actors_without_token(self):
+
+        status_code, data = self.get('/actors', {})
+
+        self.assertEqual(status_code, 401)
+        self.assertEqual(data['success'], False)
+
+class FakeRedis:
+    """The redis-py calls RedisBackend makes, over a dict"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def _get(self, key):
+        value, expires_at = self.entries.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        with self.lock:
+            if nx and self._get(key) is not None:
+                return None
+            self.entries[key] = (value, time.monotonic() + ex if ex else None)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """The response cache over a shared (fake Redis) backend"""
+
+    def setUp(self):
+        from database.cache import RedisBackend
+        self.backend = RedisBackend(FakeRedis())
+
+    def entry(self, body):
+        from database.cache import CachedResponse
+        return CachedResponse(body, 'etag', None)
+
+    def test_write_invalidates(self):
+        from database.cache import ResponseCache
+
+        cache = ResponseCache(self.backend)
+        movie = cache.key('movies', 1, '/movies/1')
+        movies = cache.key('movies', None, '/movies')
+        actor = cache.key('actors', 1, '/actors/1')
+        for key in (movie, movies, actor):
+            cache.get_or_set(key, lambda: self.entry(b'old'))
+
+        cache.on_write('movies', 'update', [{'id': 1}])
+
+        self.assertNotEqual(cache.key('movies', 1, '/movies/1'), movie)
+        self.assertNotEqual(cache.key('movies', None, '/movies'), movies)
+        self.assertEqual(cache.key('actors', 1, '/actors/1'), actor)
+        entry = cache.get_or_set(cache.key('movies', 1, '/movies/1'),
+                                 lambda: self.entry(b'new'))
+        self.assertEqual(entry.body, b'new')
+        entry = cache.get_or_set(actor, lambda: self.entry(b'new'))
+        self.assertEqual(entry.body, b'old')
+
+    def test_cold_key_computed_once(self):
+        from database.cache import ResponseCache
+
+        # two workers sharing the backend, four threads each
+        caches = [ResponseCache(self.backend) for _ in range(2)]
+        key = caches[0].key('movies', None, '/movies')
+        calls = []
+        start = threading.Barrier(8)
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return self.entry(b'body')
+
+        def get(cache):
+            start.wait()
+            return cache.get_or_set(key, compute)
+
+        with ThreadPoolExecutor(8) as pool:
+            entries = list(pool.map(get, caches * 4))
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({entry.body for entry in entries}, {b'body'})
+
+    def test_uncacheable_result_releases_waiters(self):
+        from database.cache import ResponseCache
+
+        caches = [ResponseCache(self.backend, lock_ttl=3) for _ in range(2)]
+        key = caches[0].key('movies', 1, '/movies/1')
+        start = threading.Barrier(2)
+
+        def compute():
+            time.sleep(0.1)
+            return 'not found'
+
+        def get(cache):
+            start.wait()
+            return cache.get_or_set(key, compute)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(2) as pool:
+            results = list(pool.map(get, caches))
+
+        self.assertEqual(results, ['not found', 'not found'])
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_generations_expire(self):
+        from database.cache import ResponseCache
+
+        cache = ResponseCache(self.backend, ttl=60)
+        cache.key('movies', 1, '/movies/1')
+        cache.invalidate('actors', 2)
+
+        entries = self.backend.client.entries
+        for name in ('gen:movies', 'gen:movies:1', 'gen:actors',
+                     'gen:actors:2'):
+            _, expires_at = entries[name]
+            self.assertGreater(expires_at - time.monotonic(), 60)
+
+    def test_cold_key_computed_once_async(self):
+        from database.cache import ResponseCache
+
+        cache = ResponseCache(self.backend)
+        key = cache.key('actors', None, '/actors')
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return self.entry(b'body')
+
+        async def get_all():
+            return await asyncio.gather(
+                *(cache.get_or_set_async(key, compute) for _ in range(8)))
+
+        entries = asyncio.run(get_all())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({entry.body for entry in entries}, {b'body'})
+
+
+class AuthCacheTestCase(unittest.TestCase):
+    """The JWKS store and the verified token cache, with keys signed locally"""
+
+    @classmethod
+    def setUpClass(cls):
+        from benchmarks.signer import LocalSigner
+        cls.signer = LocalSigner('test.local', 'casting', kid='first')
+        cls.rotated = LocalSigner('test.local', 'casting', kid='second')
+
+    def setUp(self):
+        import tempfile
+        self.jwks_file = tempfile.NamedTemporaryFile(suffix='.json')
+        self.publish(self.signer.jwks())
+
+    def tearDown(self):
+        self.jwks_file.close()
+
+    def publish(self, jwks):
+        with open(self.jwks_file.name, 'w') as f:
+            json.dump(jwks, f)
+
+    def test_unknown_kid_refreshes_keys(self):
+        from auth.jwks import JWKSStore
+
+        store = JWKSStore(self.jwks_file.name, min_refresh_interval=0)
+        self.assertEqual(store.get_key('first')['kid'], 'first')
+        self.assertIsNone(store.get_key('second'))
+
+        self.publish(self.rotated.jwks())
+
+        self.assertEqual(store.get_key('second')['kid'], 'second')
+        self.assertIsNone(store.get_key('first'))
+
+    def test_unknown_kid_refresh_rate_limited(self):
+        from auth.jwks import JWKSStore
+
+        store = JWKSStore(self.jwks_file.name, min_refresh_interval=60)
+        store.get_key('first')
+        self.publish(self.rotated.jwks())
+
+        self.assertIsNone(store.get_key('second'))
+
+    def test_failed_refresh_keeps_last_good_keys(self):
+        from auth.jwks import JWKSStore
+
+        store = JWKSStore(self.jwks_file.name, min_refresh_interval=0)
+        store.get_key('first')
+        with open(self.jwks_file.name, 'w') as f:
+            f.write('not a key set')
+
+        self.assertFalse(store.refresh(force=True))
+        self.assertEqual(store.get_key('first')['kid'], 'first')
+
+    def test_token_expires_at_exp(self):
+        from unittest import mock
+        from jose import jwt
+        from auth.token_cache import TokenCache
+
+        cache = TokenCache(ttl=600)
+        token = self.signer.token('client', expires_in=60)
+        payload = jwt.get_unverified_claims(token)
+        cache.put(token, payload)
+
+        self.assertEqual(cache.get(token).payload['sub'], 'client')
+        with mock.patch('auth.token_cache.time.time',
+                        return_value=payload['exp']):
+            self.assertIsNone(cache.get(token))
+
+    def test_token_cache_evicts_least_recently_used(self):
+        from jose import jwt
+        from auth.token_cache import TokenCache
+
+        cache = TokenCache(maxsize=2)
+        tokens = [self.signer.token(f'client-{i}') for i in range(3)]
+        for token in tokens[:2]:
+            cache.put(token, jwt.get_unverified_claims(token))
+        cache.get(tokens[0])
+        cache.put(tokens[2], jwt.get_unverified_claims(tokens[2]))
+
+        self.assertIsNotNone(cache.get(tokens[0]))
+        self.assertIsNone(cache.get(tokens[1]))
+        self.assertIsNotNone(cache.get(tokens[2]))
+        self.assertEqual(cache.stats()['size'], 2)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":